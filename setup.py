@@ -11,6 +11,7 @@ setup(name='webserver',
           'flasgger==0.8.3',
           'Flask==1.0.2',
           'Flask-Limiter==1.0.1',
+          'PyMySQL',
       ],
       test_suite='tests',
       zip_safe=False)
@@ -0,0 +1,114 @@
+"""Tests for webserver.asgi module."""
+import asyncio
+import json
+import unittest
+
+import flask
+
+import webserver.asgi
+
+
+@webserver.asgi.call(['number_nat'])
+async def double_handler(number_nat):
+    """Double a natural number."""
+    return {'status': 200, 'double': number_nat * 2}
+
+
+@webserver.asgi.call(max_upload_size=1024)
+async def small_upload_handler(**kwargs):
+    """Accept small requests."""
+    return {'status': 200, 'fields': sorted(kwargs)}
+
+
+def run_asgi(app, method, path, query_string=b'', body=b'', headers=None):
+    """Run an ASGI app on a single request, returning the status and the decoded body."""
+    messages = []
+
+    async def receive():
+        """Send the whole body at once."""
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        """Collect the response."""
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+        'headers': headers or [], 'server': ('testserver', 80)}
+    asyncio.new_event_loop().run_until_complete(app(scope, receive, send))
+    return messages[0]['status'], json.loads(messages[1]['body'].decode())
+
+
+class TestAsgi(unittest.TestCase):
+    """Tests for async calls served over ASGI."""
+
+    def test_call(self):
+        """Test a valid call."""
+        status, response = run_asgi(double_handler, 'GET', '/double', b'number_nat=21')
+        self.assertEqual(status, 200)
+        self.assertEqual(response['double'], 42)
+
+    def test_form_call(self):
+        """Test a valid call with a form body."""
+        status, response = run_asgi(
+            double_handler, 'POST', '/double', body=b'number_nat=4',
+            headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+        self.assertEqual(status, 200)
+        self.assertEqual(response['double'], 8)
+
+    def test_form_call_with_length(self):
+        """Test a valid call with a form body and the content length header clients send."""
+        status, response = run_asgi(
+            double_handler, 'POST', '/double', body=b'number_nat=4',
+            headers=[(b'content-type', b'application/x-www-form-urlencoded'), (b'content-length', b'12')])
+        self.assertEqual(status, 200)
+        self.assertEqual(response['double'], 8)
+
+    def test_declared_too_big(self):
+        """Test that a body declared too big is refused without being read."""
+        status, response = run_asgi(
+            small_upload_handler, 'POST', '/small', body=b'never read',
+            headers=[(b'content-type', b'application/x-www-form-urlencoded'), (b'content-length', b'2048')])
+        self.assertEqual(status, 400)
+        self.assertEqual(response['error']['internal_error_code'], 105)
+
+    def test_lifespan(self):
+        """Test that lifespan events are acknowledged."""
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            """Start, then shut down."""
+            return messages.pop(0)
+
+        async def send(message):
+            """Collect the acknowledgements."""
+            sent.append(message['type'])
+
+        asyncio.new_event_loop().run_until_complete(double_handler({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+    def test_error_envelope(self):
+        """Test that errors get the same envelope as synchronous calls."""
+        data_set = [
+            {'query_string': b'', 'internal_error_code': 100},
+            {'query_string': b'number_nat=-1', 'internal_error_code': 101},
+            {'query_string': b'number_nat=1&extra=1', 'internal_error_code': 106},
+        ]
+        for data in data_set:
+            with self.subTest(**data):
+                status, response = run_asgi(double_handler, 'GET', '/double', data['query_string'])
+                self.assertEqual(status, 400)
+                self.assertEqual(response['error']['internal_error_code'], data['internal_error_code'])
+
+
+class TestFlaskView(unittest.TestCase):
+    """Tests for async calls routed from Flask."""
+
+    def test_call(self):
+        """Test a valid call through the Flask test client."""
+        app = flask.Flask('async_test')
+        app.add_url_rule('/double', view_func=double_handler.flask_view)
+        response = app.test_client().get('/double?number_nat=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data.decode())['double'], 10)
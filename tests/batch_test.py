@@ -0,0 +1,96 @@
+"""Tests for webserver.batch module."""
+import itertools
+import json
+import unittest
+
+import stellar_base.keypair
+
+import tests.fixtures
+import webserver
+import webserver.batch
+
+BATCH_ROUTE = '/batch'
+
+
+class TestParseCalls(unittest.TestCase):
+    """Tests for parse_calls function."""
+
+    def test_parse(self):
+        """Test defaults, and refusal of malformed batches."""
+        self.assertEqual(webserver.batch.parse_calls('[{"path": "/v1/a"}, {"method": "POST", "path": "/v1/b"}]'), [
+            ('GET', '/v1/a', {}), ('POST', '/v1/b', {})])
+        for calls in ['nope', '[]', '{}', '[{"path": "v1/a"}]', '[{"path": "/v1/a", "method": "PUT"}]',
+                      json.dumps([{'path': '/v1/a'}] * (webserver.batch.BATCH_MAX_CALLS + 1))]:
+            with self.subTest(calls=calls):
+                self.assertRaises(webserver.validation.InvalidField, webserver.batch.parse_calls, calls)
+
+
+class TestBatch(unittest.TestCase):
+    """Tests for batch_handler."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Use in memory nonces and budgets, and prepare an app with authenticated endpoints and a batch route."""
+        cls.authentication = tests.fixtures.authentication()
+        cls.keypair = stellar_base.keypair.Keypair.random()
+        cls.pubkey = cls.keypair.address().decode()
+        cls.nonces = itertools.count(1)
+        cls.items = []
+
+        def add_item(user_pubkey, item):
+            """Add an item."""
+            cls.items.append((user_pubkey, item))
+            return {'status': 200}
+
+        app = webserver.create_app({'RATELIMIT_ENABLED': False})
+        app.add_url_rule('/v1/items', 'items', webserver.validation.call(require_auth=True)(
+            lambda user_pubkey: {'status': 200, 'user_pubkey': user_pubkey, 'items': [item for _, item in cls.items]}))
+        app.add_url_rule('/v1/add_item', 'add_item', webserver.validation.call(['item'], require_auth=True)(add_item),
+                         methods=['POST'])
+        app.add_url_rule(BATCH_ROUTE, 'batch', webserver.batch.batch_handler, methods=['POST'])
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Restore the configuration."""
+        cls.authentication.close()
+
+    def batch(self, calls):
+        """Post a signed batch, returning the parsed response."""
+        kwargs = {'calls': json.dumps(calls)}
+        fingerprint = webserver.validation.generate_fingerprint(
+            'http://localhost' + BATCH_ROUTE, kwargs, nonce=next(self.nonces))
+        response = self.client.post(BATCH_ROUTE, data=kwargs, headers={
+            'Pubkey': self.pubkey, 'Fingerprint': fingerprint,
+            'Signature': webserver.validation.sign_fingerprint(fingerprint, self.keypair.seed().decode())})
+        return response.status_code, json.loads(response.data.decode())
+
+    def test_batch(self):
+        """Test that sub-calls are authenticated by the batch, ordered around POSTs, and fail alone."""
+        status, response = self.batch([
+            {'path': '/v1/items'},
+            {'method': 'POST', 'path': '/v1/add_item', 'args': {'item': 'first'}},
+            {'path': '/v1/items'},
+            {'method': 'POST', 'path': '/v1/add_item'}])
+        self.assertEqual(status, 200)
+        results = response['results']
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 400])
+        self.assertEqual(results[0]['body']['user_pubkey'], self.pubkey)
+        self.assertNotIn('first', results[0]['body']['items'])
+        self.assertIn('first', results[2]['body']['items'])
+        self.assertEqual(results[3]['body']['error']['internal_error_code'], 100)
+
+    def test_nested_batch(self):
+        """Test that a batch can not contain a batch."""
+        _, response = self.batch([{'method': 'POST', 'path': BATCH_ROUTE, 'args': {'calls': []}}])
+        self.assertEqual(response['results'][0]['status'], 400)
+
+    def test_unsigned_batch(self):
+        """Test that a batch, unlike its sub-calls, must be signed."""
+        response = self.client.post(BATCH_ROUTE, data={'calls': '[{"path": "/v1/items"}]'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_forged_sub_call(self):
+        """Test that a sub-call can not be forged from outside a batch."""
+        response = self.client.get('/v1/items', headers={'Pubkey': self.pubkey})
+        self.assertEqual(response.status_code, 400)
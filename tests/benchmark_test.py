@@ -0,0 +1,177 @@
+"""
+Benchmarks for the validation pipeline, compared against the baselines in benchmark_baselines.json.
+Run with PAKET_BENCHMARK=1, or with PAKET_BENCHMARK_UPDATE=1 to store the measured timings as the new baselines.
+Timings are stored as multiples of a calibration loop timed in the same process, so that they carry over
+between machines, and a benchmark without a baseline fails, so that it can not pass for no regression.
+"""
+import io
+import itertools
+import json
+import os
+import statistics
+import time
+import unittest
+import urllib.parse
+
+import flask
+import stellar_base.keypair
+import util.logger
+
+import tests.fixtures
+import webserver.validation
+
+LOGGER = util.logger.logging.getLogger('pkt.webserver.benchmark')
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baselines.json')
+RUN_BENCHMARKS = bool(os.environ.get('PAKET_BENCHMARK'))
+UPDATE_BASELINES = bool(os.environ.get('PAKET_BENCHMARK_UPDATE'))
+# A benchmark fails when it is slower than its baseline by more than this fraction.
+# Machines differ in more than speed, so relative timings still move somewhat between them.
+TOLERANCE = float(os.environ.get('PAKET_BENCHMARK_TOLERANCE', .5))
+ITERATIONS = int(os.environ.get('PAKET_BENCHMARK_ITERATIONS', 200))
+REPEATS = 5
+ESCROW_PUBKEY = 'GAM7BELNXMX5I3CQRGQAFAYF73FMT7CV2RJHUPEYAIINT5YJ726UY2GG'
+
+
+def calibration_loop():
+    """Interpreter bound work of fixed size, the unit benchmarks are measured in."""
+    return sorted("{}={}".format(index, index * index) for index in range(100))
+
+
+def time_calls(function, arguments):
+    """Seconds taken by ITERATIONS calls of function, each with the next arguments."""
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        function(*next(arguments))
+    return time.perf_counter() - start
+
+
+def measure(function, arguments=None):
+    """
+    Time function in calibration loops: the median over REPEATS rounds of the time of ITERATIONS calls of function,
+    each with the next arguments, divided by the time of as many calibration loops, run right before them.
+    """
+    arguments = iter(arguments or itertools.repeat(()))
+    return statistics.median(
+        time_calls(function, arguments) / time_calls(calibration_loop, itertools.repeat(()))
+        for _ in range(REPEATS))
+
+
+@unittest.skipUnless(RUN_BENCHMARKS or UPDATE_BASELINES, 'set PAKET_BENCHMARK to run benchmarks')
+class TestBenchmarks(unittest.TestCase):
+    """Benchmarks with regression thresholds."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Use in memory nonces and budgets, and prepare an app with an endpoint per call type."""
+        cls.authentication = tests.fixtures.authentication('1000000000 per minute')
+        with open(BASELINES_PATH) as baselines_file:
+            cls.baselines = json.load(baselines_file)
+        cls.results = {}
+        cls.keypair = stellar_base.keypair.Keypair.random()
+        cls.pubkey = cls.keypair.address().decode()
+        cls.nonces = itertools.count(1)
+
+        app = flask.Flask('benchmark_test')
+        app.add_url_rule('/v1/anonymous', 'anonymous', webserver.validation.call(['escrow_pubkey', 'amount_nat'])(
+            lambda escrow_pubkey, amount_nat: {'status': 200, 'amount': amount_nat}))
+        app.add_url_rule('/v1/authenticated', 'authenticated', webserver.validation.call(
+            ['escrow_pubkey'], require_auth=True)(
+                lambda user_pubkey, escrow_pubkey: {'status': 200, 'user_pubkey': user_pubkey}))
+        app.add_url_rule('/v1/upload', 'upload', webserver.validation.call(['photo'])(
+            lambda photo: {'status': 200, 'size': len(photo)}), methods=['POST'])
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Restore the configuration, and store the baselines if asked to."""
+        cls.authentication.close()
+        if UPDATE_BASELINES:
+            cls.baselines.update(cls.results)
+            with open(BASELINES_PATH, 'w') as baselines_file:
+                json.dump(cls.baselines, baselines_file, indent=2, sort_keys=True)
+                baselines_file.write('\n')
+
+    def check(self, name, relative):
+        """Record a timing in calibration loops, and fail if it regressed."""
+        self.results[name] = relative
+        LOGGER.info("%s: %.3f calibration loops", name, relative)
+        if UPDATE_BASELINES:
+            return
+        if name not in self.baselines:
+            self.fail("no baseline for {}, run with PAKET_BENCHMARK_UPDATE=1".format(name))
+        self.assertLessEqual(relative, self.baselines[name] * (1 + TOLERANCE), "{} regressed from {} to {}".format(
+            name, self.baselines[name], relative))
+
+    def request(self, status, path, method='GET', **kwargs):
+        """Make a request, failing unless it gets status, so that a benchmark times the path it is named after."""
+        response = self.client.open(path, method=method, **kwargs)
+        self.assertEqual(response.status_code, status, response.data)
+
+    def signed_headers(self, url, kwargs):
+        """Authentication headers for a call, each with a fresh nonce."""
+        while True:
+            fingerprint = webserver.validation.generate_fingerprint(url, kwargs, nonce=next(self.nonces))
+            signature = webserver.validation.sign_fingerprint(fingerprint, self.keypair.seed().decode())
+            yield ({'Pubkey': self.pubkey, 'Fingerprint': fingerprint, 'Signature': signature},)
+
+    def prepared(self, generator):
+        """Everything a benchmark will consume from generator, generated ahead of the measurement."""
+        return list(itertools.islice(generator, REPEATS * ITERATIONS))
+
+    def test_anonymous_call(self):
+        """Benchmark an unauthenticated call."""
+        self.check('anonymous_call', measure(lambda: self.request(
+            200, '/v1/anonymous', query_string={'escrow_pubkey': ESCROW_PUBKEY, 'amount_nat': '10'})))
+
+    def test_authenticated_call(self):
+        """Benchmark an authenticated call."""
+        kwargs = {'escrow_pubkey': ESCROW_PUBKEY}
+        # Fingerprints are checked against the full url, query string included.
+        path = "/v1/authenticated?{}".format(urllib.parse.urlencode(kwargs))
+        headers = self.prepared(self.signed_headers('http://localhost' + path, kwargs))
+        self.check('authenticated_call', measure(lambda headers: self.request(200, path, headers=headers), headers))
+
+    def test_upload_call(self):
+        """Benchmark a call with a file upload."""
+        content = b'0' * 64 * 1024
+        self.check('upload_call', measure(lambda: self.request(
+            200, '/v1/upload', 'POST', data={'photo': (io.BytesIO(content), 'photo.jpg')})))
+
+    def test_missing_field_call(self):
+        """Benchmark a call refused for a missing field."""
+        self.check('missing_field_call', measure(lambda: self.request(400, '/v1/anonymous')))
+
+    def test_bad_signature_call(self):
+        """Benchmark a call refused for a bad signature."""
+        kwargs = {'escrow_pubkey': ESCROW_PUBKEY}
+        path = "/v1/authenticated?{}".format(urllib.parse.urlencode(kwargs))
+        headers = next(self.signed_headers('http://localhost' + path, kwargs))[0]
+        headers['Pubkey'] = ESCROW_PUBKEY
+        self.check('bad_signature_call', measure(lambda: self.request(403, path, headers=headers)))
+
+    def test_check_fingerprint(self):
+        """Benchmark check_fingerprint."""
+        kwargs = {'escrow_pubkey': ESCROW_PUBKEY, 'amount_nat': '10'}
+        fingerprints = self.prepared(
+            (webserver.validation.generate_fingerprint('/v1/call', kwargs, nonce=nonce),) for nonce in self.nonces)
+        self.check('check_fingerprint', measure(lambda fingerprint: webserver.validation.check_fingerprint(
+            self.pubkey, fingerprint, '/v1/call', kwargs), fingerprints))
+
+    def test_check_signature(self):
+        """Benchmark check_signature."""
+        fingerprint = webserver.validation.generate_fingerprint('/v1/call', {'escrow_pubkey': ESCROW_PUBKEY})
+        signature = webserver.validation.sign_fingerprint(fingerprint, self.keypair.seed().decode())
+        self.check('check_signature', measure(
+            lambda: webserver.validation.check_signature(self.pubkey, fingerprint, signature)))
+
+    def test_check_and_fix_values(self):
+        """Benchmark check_and_fix_values."""
+        kwargs = {'escrow_pubkey': ESCROW_PUBKEY, 'amount_nat': '10', 'memo': 'benchmark'}
+        self.check('check_and_fix_values', measure(
+            lambda: webserver.validation.check_and_fix_values(dict(kwargs))))
+
+    def test_generate_fingerprint(self):
+        """Benchmark generate_fingerprint."""
+        kwargs = {'escrow_pubkey': ESCROW_PUBKEY, 'amount_nat': '10', 'memo': 'a,b=c'}
+        self.check('generate_fingerprint', measure(
+            lambda: webserver.validation.generate_fingerprint('/v1/call', kwargs, nonce=1)))
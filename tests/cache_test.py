@@ -0,0 +1,95 @@
+"""Tests for webserver.cache module."""
+import json
+import time
+import unittest
+
+import flask
+
+import webserver.cache
+import webserver.validation
+
+
+class TestResponseCache(unittest.TestCase):
+    """Tests for ResponseCache class."""
+
+    def test_lru_and_ttl(self):
+        """Test eviction of the least recently used and of expired responses."""
+        cache = webserver.cache.ResponseCache('cache_test_lru', .2, size=2)
+        for index in range(3):
+            cache.put({'index': index}, {'status': 200, 'index': index})
+        self.assertIsNone(cache.get({'index': 0}))
+        self.assertEqual(cache.get({'index': 1})['index'], 1)
+        time.sleep(.3)
+        self.assertIsNone(cache.get({'index': 1}))
+
+    def test_errors_not_cached(self):
+        """Test that only successful responses are cached."""
+        cache = webserver.cache.ResponseCache('cache_test_errors', 60)
+        cache.put({'index': 0}, {'status': 400, 'error': 'bad'})
+        self.assertIsNone(cache.get({'index': 0}))
+
+    def test_invalidate(self):
+        """Test dropping responses by argument."""
+        cache = webserver.cache.ResponseCache('cache_test_invalidate', 60)
+        for user in ['alice', 'bob']:
+            cache.put({'user_pubkey': user, 'page': 1}, {'status': 200, 'user': user})
+        webserver.cache.invalidate('cache_test_invalidate', user_pubkey='alice')
+        self.assertIsNone(cache.get({'user_pubkey': 'alice', 'page': 1}))
+        self.assertIsNotNone(cache.get({'user_pubkey': 'bob', 'page': 1}))
+        webserver.cache.invalidate()
+        self.assertIsNone(cache.get({'user_pubkey': 'bob', 'page': 1}))
+
+
+class TestCachedCall(unittest.TestCase):
+    """Tests for calls with a response cache."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare an app with a cached endpoint that counts its calls."""
+        cls.calls = []
+        app = flask.Flask('cache_test')
+
+        def cached_handler(page_nat):
+            """Record the call."""
+            cls.calls.append(page_nat)
+            return {'status': 200, 'page': page_nat, 'calls': len(cls.calls)}
+
+        cls.view = webserver.validation.call(cache=60)(cached_handler)
+        app.add_url_rule('/cached', 'cached', cls.view, methods=['GET', 'POST'])
+        cls.client = app.test_client()
+
+    def test_cached(self):
+        """Test that repeated calls reuse the response, until it is invalidated."""
+        first = self.client.get('/cached', query_string={'page_nat': '7'})
+        second = self.client.get('/cached', query_string={'page_nat': '7'})
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.calls.count(7), 1)
+        self.assertIn('max-age=60', first.headers['Cache-Control'])
+        response = self.client.get(
+            '/cached', query_string={'page_nat': '7'}, headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.client.get('/cached', query_string={'page_nat': '8'})
+        self.assertEqual(self.calls.count(8), 1)
+        self.view.cache.invalidate(page_nat=7)
+        response = self.client.get('/cached', query_string={'page_nat': '7'})
+        self.assertEqual(self.calls.count(7), 2)
+        self.assertEqual(json.loads(response.data.decode())['calls'], len(self.calls))
+
+    def test_post_not_cached(self):
+        """Test that only idempotent requests are answered from the cache."""
+        self.client.get('/cached', query_string={'page_nat': '9'})
+        self.client.post('/cached', data={'page_nat': '9'})
+        self.client.post('/cached', data={'page_nat': '9'})
+        self.assertEqual(self.calls.count(9), 3)
+
+    def test_same_names(self):
+        """Test that handlers sharing a name, as in versioned blueprints, get their own caches."""
+        views = []
+        for version in range(2):
+            def get_package(version=version):
+                """A versioned handler."""
+                return {'status': 200, 'version': version}
+            get_package.__qualname__ = "v{}.get_package".format(version)
+            views.append(webserver.validation.call(cache=60)(get_package))
+        self.assertIsNot(views[0].cache, views[1].cache)
+        self.assertIs(webserver.cache.CACHES[webserver.cache.cache_name(views[1].__wrapped__)], views[1].cache)
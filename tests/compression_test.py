@@ -0,0 +1,97 @@
+"""Tests for webserver.compression module."""
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+import flask
+
+import webserver.compression
+import webserver.static
+
+ROWS = [{'package': index, 'status': 'in transit'} for index in range(200)]
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+    """Tests for CompressionMiddleware class."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare an app with large, small, streamed, binary and encoded responses."""
+        app = flask.Flask('compression_test')
+        app.add_url_rule('/large', 'large', lambda: flask.jsonify(ROWS))
+        app.add_url_rule('/small', 'small', lambda: flask.jsonify({'status': 200}))
+        app.add_url_rule('/streamed', 'streamed', lambda: flask.Response(
+            (json.dumps(row) + '\n' for row in ROWS), mimetype='text/plain'))
+        app.add_url_rule('/binary', 'binary', lambda: flask.Response(b'0' * 4096, mimetype='image/png'))
+        app.add_url_rule('/encoded', 'encoded', lambda: flask.Response(
+            gzip.compress(b'0' * 4096), mimetype='text/plain', headers={'Content-Encoding': 'gzip'}))
+        app.add_url_rule('/missing', 'missing', lambda: flask.Response(b'0' * 4096, 404, mimetype='text/plain'))
+        app.wsgi_app = webserver.compression.CompressionMiddleware(app.wsgi_app, min_size=1024)
+        cls.client = app.test_client()
+
+    def get(self, path, method='GET', encoding='gzip'):
+        """Request a path accepting an encoding."""
+        return self.client.open(path, method=method, headers={'Accept-Encoding': encoding} if encoding else {})
+
+    def test_compressed(self):
+        """Test that large and streamed responses are compressed when accepted."""
+        for path in ['/large', '/streamed']:
+            with self.subTest(path=path):
+                plain = self.get(path, encoding=None)
+                response = self.get(path)
+                self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+                self.assertIn('Accept-Encoding', response.headers['Vary'])
+                self.assertEqual(gzip.decompress(response.data), plain.data)
+                self.assertLess(len(response.data), len(plain.data))
+
+    def test_not_compressed(self):
+        """Test that responses are left alone when not accepted, small, binary, encoded, failed, or to HEAD."""
+        for path, method, encoding in [
+                ('/large', 'GET', None), ('/large', 'GET', 'identity'), ('/large', 'HEAD', 'gzip'),
+                ('/small', 'GET', 'gzip'), ('/binary', 'GET', 'gzip'), ('/missing', 'GET', 'gzip')]:
+            with self.subTest(path=path, method=method, encoding=encoding):
+                self.assertNotIn('Content-Encoding', self.get(path, method, encoding).headers)
+        self.assertEqual(self.get('/encoded').data, gzip.compress(b'0' * 4096))
+
+    def test_choose_encoding(self):
+        """Test negotiation, brotli preferred when installed."""
+        choose = webserver.compression.CompressionMiddleware.choose_encoding
+        self.assertEqual(choose({'HTTP_ACCEPT_ENCODING': 'gzip;q=0.5, deflate'}), 'gzip')
+        self.assertIsNone(choose({'HTTP_ACCEPT_ENCODING': 'gzip;q=0'}))
+        self.assertEqual(
+            choose({'HTTP_ACCEPT_ENCODING': 'gzip, br'}), 'br' if webserver.compression.brotli else 'gzip')
+
+
+class TestRevalidation(unittest.TestCase):
+    """Tests for conditional requests to compressed responses."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare an app serving static files through the middleware."""
+        cls.directory = tempfile.TemporaryDirectory()
+        for path, content in [('style.css', b'body { color: black; }\n' * 256), ('app.js', b'var a = 1;\n' * 512)]:
+            with open(os.path.join(cls.directory.name, path), 'wb') as static_file:
+                static_file.write(content)
+        index = webserver.static.StaticIndex([cls.directory.name])
+        app = flask.Flask('revalidation_test')
+        app.add_url_rule('/<path:path>', 'files', lambda path: index.response(path) or ('missing', 404))
+        app.wsgi_app = webserver.compression.CompressionMiddleware(app.wsgi_app, min_size=1024)
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the static directory."""
+        cls.directory.cleanup()
+
+    def test_not_modified(self):
+        """Test that the weakened ETag of a compressed file revalidates."""
+        for path in ['/style.css', '/app.js']:
+            with self.subTest(path=path):
+                response = self.client.get(path, headers={'Accept-Encoding': 'gzip'})
+                self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+                self.assertTrue(response.headers['ETag'].startswith('W/'))
+                response = self.client.get(path, headers={
+                    'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+                self.assertEqual(response.status_code, 304)
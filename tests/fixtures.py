@@ -0,0 +1,20 @@
+"""Fixtures shared by tests."""
+import contextlib
+import unittest.mock
+
+import webserver.nonces
+import webserver.ratelimit
+import webserver.validation
+
+
+def authentication(budget='1000 per minute'):
+    """
+    Authenticate calls outside debug mode, with in memory nonces and pubkey budgets of budget,
+    until the returned ExitStack is closed.
+    """
+    stack = contextlib.ExitStack()
+    stack.enter_context(unittest.mock.patch.multiple(
+        webserver.validation, DEBUG=False, NONCE_STORE=webserver.nonces.MemoryNonceStore()))
+    stack.enter_context(unittest.mock.patch.object(
+        webserver.ratelimit, 'PUBKEY_BUDGET', webserver.ratelimit.PubkeyBudget(budget, 'memory://')))
+    return stack
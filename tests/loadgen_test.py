@@ -0,0 +1,52 @@
+"""Tests for webserver.loadgen module."""
+import unittest
+
+import webserver.loadgen
+import webserver.validation
+
+
+class TestPrepareRequests(unittest.TestCase):
+    """Tests for prepare_requests function."""
+
+    def test_split_and_signed(self):
+        """Test that requests are split between workers, signed with increasing nonces."""
+        plans = webserver.loadgen.prepare_requests(
+            'http://localhost/v1/call', 'GET', {'escrow_pubkey': 'pubkey'}, workers=3, count=10)
+        self.assertEqual([len(plan) for plan in plans], [4, 3, 3])
+        for plan in plans:
+            nonces = []
+            for request in plan:
+                self.assertEqual(request.url, 'http://localhost/v1/call?escrow_pubkey=pubkey')
+                url, _, nonce = webserver.validation.parse_fingerprint(request.headers['Fingerprint'])
+                self.assertEqual(url, request.url)
+                webserver.validation.check_signature(
+                    request.headers['Pubkey'], request.headers['Fingerprint'], request.headers['Signature'])
+                nonces.append(int(nonce))
+            self.assertEqual(nonces, sorted(set(nonces)))
+
+    def test_unsigned(self):
+        """Test unsigned POST requests."""
+        plan, = webserver.loadgen.prepare_requests(
+            'http://localhost/v1/call', 'POST', {'amount': '1'}, count=2, sign=False)
+        self.assertEqual(plan[0].data, b'amount=1')
+        self.assertNotIn('Signature', plan[0].headers)
+
+
+class TestReport(unittest.TestCase):
+    """Tests for the latency report."""
+
+    def test_percentile(self):
+        """Test nearest rank percentiles."""
+        values = list(range(1, 1001))
+        self.assertEqual(webserver.loadgen.percentile(values, 50), 500)
+        self.assertEqual(webserver.loadgen.percentile(values, 99.9), 999)
+        self.assertEqual(webserver.loadgen.percentile(values, 100), 1000)
+        self.assertIsNone(webserver.loadgen.percentile([], 50))
+
+    def test_report(self):
+        """Test that errors are broken down by outcome."""
+        results = [(.01, 'ok')] * 8 + [(.5, 'internal_error_code 104')] * 2
+        report = webserver.loadgen.report(results, 2)
+        self.assertIn('10 requests in 2.00 seconds, 5.0 per second', report)
+        self.assertIn('p99 500.0ms', report)
+        self.assertIn('       2 internal_error_code 104', report)
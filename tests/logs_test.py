@@ -0,0 +1,106 @@
+"""Tests for webserver.logs module."""
+import logging
+import queue
+import time
+import unittest
+
+import webserver.logs
+
+
+def make_record(msg, *args):
+    """An error record."""
+    return logging.makeLogRecord({'name': 'pkt.test', 'levelno': logging.ERROR, 'msg': msg, 'args': args})
+
+
+class ListHandler(logging.Handler):
+    """Keep the messages of handled records."""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestKeyValues(unittest.TestCase):
+    """Tests for KeyValues class."""
+
+    def test_render(self):
+        """Test rendering and quoting."""
+        self.assertEqual(
+            str(webserver.logs.KeyValues(event='call_error', status=400, message='bad nonce', empty='')),
+            'event=call_error status=400 message="bad nonce" empty=""')
+
+
+class TestDroppingQueueHandler(unittest.TestCase):
+    """Tests for DroppingQueueHandler class."""
+
+    def test_drop(self):
+        """Test that a full queue drops records instead of blocking."""
+        handler = webserver.logs.DroppingQueueHandler(queue.Queue(1))
+        for _ in range(3):
+            handler.handle(make_record('storm'))
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.dropped, 2)
+
+
+class TestDeduplicatingHandler(unittest.TestCase):
+    """Tests for DeduplicatingHandler class."""
+
+    def test_suppress_and_summarize(self):
+        """Test that repeats are suppressed, and summarized on flush."""
+        target = ListHandler()
+        handler = webserver.logs.DeduplicatingHandler([target], interval=60)
+        for _ in range(5):
+            handler.handle(make_record("failed %s", 'once'))
+        handler.handle(make_record("failed %s", 'twice'))
+        self.assertEqual(target.messages, ['failed once', 'failed twice'])
+        handler.flush()
+        self.assertEqual(len(target.messages), 3)
+        self.assertTrue(target.messages[2].startswith('4 repeats suppressed'), target.messages[2])
+
+    def test_window_end(self):
+        """Test that a repeat after the interval is emitted again."""
+        target = ListHandler()
+        handler = webserver.logs.DeduplicatingHandler([target], interval=0)
+        for _ in range(2):
+            handler.handle(make_record('failed'))
+        self.assertEqual(target.messages, ['failed', 'failed'])
+
+
+class TestAsyncLogging(unittest.TestCase):
+    """Tests for AsyncLogging class."""
+
+    def test_emit_through_listener(self):
+        """Test that records reach the original handlers through the listener, deduplicated."""
+        logger = logging.getLogger('pkt.web.logs_test')
+        target = ListHandler()
+        logger.addHandler(target)
+        async_logging = webserver.logs.AsyncLogging([logger.name], interval=60)
+        try:
+            self.assertEqual(logger.handlers, [async_logging.queue_handler])
+            for _ in range(3):
+                logger.error("%s", webserver.logs.KeyValues(event='call_error', status=500))
+        finally:
+            async_logging.stop()
+        self.assertEqual(target.messages[0], 'event=call_error status=500')
+        self.assertTrue(target.messages[1].startswith('2 repeats suppressed'), target.messages)
+
+    def test_summary_after_burst(self):
+        """Test that repeats are summarized once their window ends, with no record after them."""
+        logger = logging.getLogger('pkt.web.logs_burst_test')
+        target = ListHandler()
+        logger.addHandler(target)
+        async_logging = webserver.logs.AsyncLogging([logger.name], interval=.1, sweep_interval=.05)
+        try:
+            for _ in range(3):
+                logger.error('burst')
+            deadline = time.monotonic() + 5
+            while len(target.messages) < 2 and time.monotonic() < deadline:
+                time.sleep(.05)
+            messages = list(target.messages)
+        finally:
+            async_logging.stop()
+        self.assertEqual(messages[0], 'burst')
+        self.assertTrue(messages[1].startswith('2 repeats suppressed'), messages)
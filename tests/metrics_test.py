@@ -0,0 +1,51 @@
+"""Tests for webserver.metrics module."""
+import unittest
+
+import webserver.metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for the metric classes."""
+
+    def test_counter(self):
+        """Test counter rendering with escaped labels."""
+        counter = webserver.metrics.Counter('test_total', 'Test counter.', ['path'])
+        counter.inc('a"b')
+        counter.inc('a"b', amount=2)
+        self.assertEqual(counter.render(), [
+            '# HELP test_total Test counter.', '# TYPE test_total counter', 'test_total{path="a\\"b"} 3'])
+
+    def test_histogram(self):
+        """Test that histogram buckets are cumulative."""
+        histogram = webserver.metrics.Histogram('test_seconds', 'Test histogram.', ['stage'], buckets=(.1, 1))
+        for value in (.05, .5, .5, 5):
+            histogram.observe(value, 'handler')
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{stage="handler",le="0.1"} 1',
+            'test_seconds_bucket{stage="handler",le="1.0"} 3',
+            'test_seconds_bucket{stage="handler",le="+Inf"} 4',
+            'test_seconds_sum{stage="handler"} 6.05',
+            'test_seconds_count{stage="handler"} 4'])
+
+    def test_observe_call(self):
+        """Test that calls are counted by status and internal error code."""
+        webserver.metrics.observe_call(
+            'metrics_test', {'handler': .01}, {'status': 400, 'error': {'internal_error_code': 100}})
+        webserver.metrics.observe_call('metrics_test', {'handler': .01}, {'status': 200})
+        rendered = webserver.metrics.REGISTRY.render()
+        self.assertIn('paket_call_responses_total{endpoint="metrics_test",status="400",internal_error_code="100"} 1',
+                      rendered)
+        self.assertIn('paket_call_responses_total{endpoint="metrics_test",status="200",internal_error_code=""} 1',
+                      rendered)
+        self.assertIn('paket_call_stage_seconds_count{endpoint="metrics_test",stage="handler"} 2', rendered)
+
+    def test_authorized(self):
+        """Test that a configured token is required for scraping."""
+        saved_token, webserver.metrics.METRICS_TOKEN = webserver.metrics.METRICS_TOKEN, 'secret'
+        try:
+            self.assertTrue(webserver.metrics.authorized('Bearer secret'))
+            for authorization in [None, '', 'Bearer wrong', 'secret']:
+                with self.subTest(authorization=authorization):
+                    self.assertFalse(webserver.metrics.authorized(authorization))
+        finally:
+            webserver.metrics.METRICS_TOKEN = saved_token
@@ -0,0 +1,140 @@
+"""Tests for webserver.nonces module."""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import webserver.nonces
+
+
+class NonceStoreTestMixin:
+    """Tests every nonce store must pass."""
+
+    def create_store(self):
+        """Create the store under test."""
+        raise NotImplementedError
+
+    def setUp(self):
+        """Create and initialize a fresh store."""
+        self.store = self.create_store()
+        self.store.init_db()
+
+    def test_advance(self):
+        """Test that nonces only move forward."""
+        self.assertTrue(self.store.advance('pubkey', 0))
+        self.assertFalse(self.store.advance('pubkey', 0))
+        self.assertTrue(self.store.advance('pubkey', 5))
+        self.assertFalse(self.store.advance('pubkey', 4))
+        self.assertTrue(self.store.advance('another_pubkey', 1))
+
+    def test_get_and_advance_many(self):
+        """Test reading nonces and advancing them in batches."""
+        self.assertIsNone(self.store.get('pubkey'))
+        self.store.advance('pubkey', 5)
+        self.store.advance_many([('pubkey', 3, None), ('another_pubkey', 7, None)])
+        self.assertEqual(self.store.get('pubkey'), 5)
+        self.assertEqual(self.store.get('another_pubkey'), 7)
+
+    def test_concurrent_advance(self):
+        """Test that only one of many concurrent calls with the same nonce succeeds."""
+        results = []
+
+        def advance():
+            """Try to advance to the same nonce."""
+            results.append(self.store.advance('racing_pubkey', 42))
+
+        threads = [threading.Thread(target=advance) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1)
+
+
+class TestMemoryNonceStore(NonceStoreTestMixin, unittest.TestCase):
+    """Tests for MemoryNonceStore."""
+
+    def create_store(self):
+        """Create a memory store with few stripes to exercise sharing."""
+        return webserver.nonces.MemoryNonceStore(stripes=2)
+
+    def test_bytes_pubkey(self):
+        """Test that bytes pubkeys, as stellar_base gives them, are the same pubkeys as text ones."""
+        self.assertTrue(self.store.advance(b'pubkey', 5))
+        self.assertFalse(self.store.advance('pubkey', 5))
+        self.assertEqual(self.store.get(b'pubkey'), 5)
+
+
+class TestSQLiteNonceStore(NonceStoreTestMixin, unittest.TestCase):
+    """Tests for SQLiteNonceStore."""
+
+    def create_store(self):
+        """Create an SQLite store in a temporary directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        return webserver.nonces.SQLiteNonceStore(os.path.join(self.directory.name, 'nonces.db'))
+
+    def tearDown(self):
+        """Remove the database."""
+        self.directory.cleanup()
+
+
+class TestFromConfig(unittest.TestCase):
+    """Tests for from_config function."""
+
+    def test_unknown_store(self):
+        """Test that unknown stores are refused."""
+        with self.assertRaises(ValueError):
+            webserver.nonces.from_config('papyrus')
+
+    def test_memory_store(self):
+        """Test choosing a store by name."""
+        self.assertIsInstance(webserver.nonces.from_config('memory'), webserver.nonces.MemoryNonceStore)
+
+
+class TestReplayWindowNonceStore(unittest.TestCase):
+    """Tests for ReplayWindowNonceStore."""
+
+    def setUp(self):
+        """Create a window store backed by a memory store."""
+        self.backing_store = webserver.nonces.MemoryNonceStore()
+        self.store = webserver.nonces.ReplayWindowNonceStore(
+            self.backing_store, window=60000, recent=4, flush_interval=3600)
+        self.now = int(time.time() * 1000)
+
+    def test_window(self):
+        """Test that nonces are accepted out of order inside the window, and only once."""
+        self.assertTrue(self.store.advance('pubkey', self.now + 20))
+        self.assertTrue(self.store.advance('pubkey', self.now + 10))
+        self.assertFalse(self.store.advance('pubkey', self.now + 10))
+        self.assertFalse(self.store.advance('pubkey', self.now + 120000))
+        self.assertFalse(self.store.advance('pubkey', self.now - 120000))
+        # Nonces from before the store started might have been accepted by a previous process.
+        self.assertFalse(self.store.advance('pubkey', self.store.floor - 1))
+
+    def test_bytes_pubkey(self):
+        """Test that bytes pubkeys are the same pubkeys as text ones."""
+        self.assertTrue(self.store.advance(b'pubkey', self.now + 20))
+        self.assertFalse(self.store.advance('pubkey', self.now + 20))
+        self.assertEqual(self.store.get(b'pubkey'), self.now + 20)
+
+    def test_full(self):
+        """Test that nonces below all the remembered ones are refused once the list is full."""
+        for offset in range(10, 60, 10):
+            self.assertTrue(self.store.advance('pubkey', self.now + offset))
+        self.assertFalse(self.store.advance('pubkey', self.now + 5))
+        self.assertFalse(self.store.advance('pubkey', self.now + 10))
+        self.assertTrue(self.store.advance('pubkey', self.now + 25))
+
+    def test_flush_and_restart(self):
+        """Test that flushed high water marks refuse replays after a restart."""
+        self.assertTrue(self.store.advance('pubkey', self.now + 30000))
+        self.assertTrue(self.store.advance('pubkey', self.now + 20000))
+        self.assertIsNone(self.backing_store.get('pubkey'))
+        self.store.flush()
+        self.assertEqual(self.backing_store.get('pubkey'), self.now + 30000)
+        restarted_store = webserver.nonces.ReplayWindowNonceStore(
+            self.backing_store, window=60000, recent=4, flush_interval=3600)
+        self.assertFalse(restarted_store.advance('pubkey', self.now + 30000))
+        self.assertFalse(restarted_store.advance('pubkey', self.now + 20000))
+        self.assertTrue(restarted_store.advance('pubkey', self.now + 40000))
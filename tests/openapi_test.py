@@ -0,0 +1,76 @@
+"""Tests for webserver.openapi module."""
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+import flask
+
+import webserver
+import webserver.openapi
+
+SWAGGER_CONFIG = {
+    'title': 'OpenAPI test',
+    'uiversion': 2,
+    'specs_route': '/apidocs/',
+    'specs': [{'endpoint': 'apispec', 'route': '/apispec.json'}]}
+
+
+class TestCachedSpec(unittest.TestCase):
+    """Tests for cached spec serving."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare an app documenting a single endpoint."""
+        blueprint = flask.Blueprint('openapi_test', __name__)
+
+        @blueprint.route('/v1/ping')
+        # pylint: disable=unused-variable
+        def ping():
+            """
+            Ping.
+            ---
+            responses:
+              200:
+                description: pong
+            """
+            return 'pong'
+
+        cls.app = webserver.setup(blueprint, SWAGGER_CONFIG, webserver.create_app())
+        cls.client = cls.app.test_client()
+
+    def test_rendered_once(self):
+        """Test that the spec is rendered on first use and then reused."""
+        cached_spec, = self.app.extensions['paket_openapi']
+        response = self.client.get('/apispec.json')
+        self.assertIn('/v1/ping', json.loads(response.data.decode())['paths'])
+        body = cached_spec.body
+        self.assertIsNotNone(body)
+        self.client.get('/apispec.json')
+        self.assertIs(cached_spec.body, body)
+
+    def test_headers(self):
+        """Test compression and conditional requests."""
+        response = self.client.get('/apispec.json', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('max-age', response.headers['Cache-Control'])
+        identity_response = self.client.get('/apispec.json')
+        self.assertEqual(gzip.decompress(response.data), identity_response.data)
+        self.assertNotEqual(response.headers['ETag'], identity_response.headers['ETag'])
+        for etag, encoding in [(response.headers['ETag'], 'gzip'), (identity_response.headers['ETag'], 'identity')]:
+            with self.subTest(encoding=encoding):
+                revalidated = self.client.get(
+                    '/apispec.json', headers={'Accept-Encoding': encoding, 'If-None-Match': etag})
+                self.assertEqual(revalidated.status_code, 304)
+                revalidated = self.client.get(
+                    '/apispec.json', headers={'Accept-Encoding': encoding, 'If-None-Match': 'W/' + etag})
+                self.assertEqual(revalidated.status_code, 304)
+
+    def test_dump(self):
+        """Test writing the spec into a static directory."""
+        with tempfile.TemporaryDirectory() as directory:
+            webserver.openapi.dump(self.app, directory)
+            with open(os.path.join(directory, 'apispec.json'), 'rb') as spec_file:
+                self.assertEqual(spec_file.read(), self.client.get('/apispec.json').data)
+            self.assertTrue(os.path.exists(os.path.join(directory, 'apispec.json.gz')))
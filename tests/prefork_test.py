@@ -0,0 +1,112 @@
+"""Tests for webserver.prefork module."""
+import os
+import signal
+import time
+import unittest
+import urllib.request
+
+import webserver.asgi
+import webserver.batch
+import webserver.nonces
+import webserver.prefork
+import webserver.validation
+import webserver.verifiers
+
+
+def pid_app(_, start_response):
+    """Answer with the pid of the serving process."""
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode()]
+
+
+class TestPreforkServer(unittest.TestCase):
+    """Tests for PreforkServer class."""
+
+    def setUp(self):
+        """Fork a master with two workers, each replaced after three requests."""
+        server = webserver.prefork.PreforkServer(pid_app, '127.0.0.1', 0, 2, max_requests=3)
+        self.url = "http://127.0.0.1:{}/".format(server.listen())
+        self.master = os.fork()
+        if not self.master:
+            try:
+                server.run()
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+        server.listener.close()
+
+    def tearDown(self):
+        """Shut the master down."""
+        os.kill(self.master, signal.SIGTERM)
+        self.assertEqual(os.waitpid(self.master, 0)[1], 0)
+
+    def get_pids(self, count):
+        """The pids serving count requests."""
+        return [urllib.request.urlopen(self.url, timeout=10).read() for _ in range(count)]
+
+    def test_recycle(self):
+        """Test that workers are replaced after serving their share."""
+        self.assertGreater(len(set(self.get_pids(12))), 2)
+
+    def test_reload(self):
+        """Test that SIGHUP replaces the workers."""
+        old_pids = set(self.get_pids(2))
+        os.kill(self.master, signal.SIGHUP)
+        time.sleep(1)
+        self.assertFalse(old_pids.intersection(self.get_pids(2)))
+
+
+class TestAfterFork(unittest.TestCase):
+    """Tests for after_fork function."""
+
+    def test_after_fork(self):
+        """Test that a forked worker gets its own nonce store, pools and working executors."""
+        webserver.validation.NONCE_STORE = webserver.nonces.MemoryNonceStore()
+        webserver.verifiers.OFFLOAD_POOL = object()
+        # Start the executor threads, which the child will not have.
+        webserver.batch.EXECUTOR.submit(int).result()
+        webserver.asgi.EXECUTOR.submit(int).result()
+        child = os.fork()
+        if not child:
+            status = 1
+            try:
+                webserver.prefork.after_fork()
+                if webserver.validation.NONCE_STORE is None and webserver.verifiers.OFFLOAD_POOL is None:
+                    webserver.batch.EXECUTOR.submit(int).result(timeout=5)
+                    webserver.asgi.EXECUTOR.submit(int).result(timeout=5)
+                    status = 0
+            finally:
+                os._exit(status)  # pylint: disable=protected-access
+        webserver.validation.NONCE_STORE = webserver.verifiers.OFFLOAD_POOL = None
+        self.assertEqual(os.waitpid(child, 0)[1], 0)
+
+    def test_replay_window_flush(self):
+        """Test that a forked child does not flush the pending nonces of its parent."""
+        backing_store = webserver.nonces.MemoryNonceStore()
+        store = webserver.nonces.ReplayWindowNonceStore(backing_store, flush_interval=3600)
+        self.assertTrue(store.advance('pubkey', int(time.time() * 1000) + 1000))
+        store.pid = -1
+        store.flush()
+        self.assertIsNone(backing_store.get('pubkey'))
+        store.pid = os.getpid()
+        store.flush()
+        self.assertIsNotNone(backing_store.get('pubkey'))
+
+
+class TestCheckNonceStore(unittest.TestCase):
+    """Tests for check_nonce_store function."""
+
+    def test_window_store(self):
+        """Test that a replay window per worker is refused, and a single one accepted."""
+        saved = webserver.nonces.NONCE_STORE, webserver.validation.NONCE_STORE
+        try:
+            webserver.validation.NONCE_STORE = None
+            webserver.nonces.NONCE_STORE = 'window'
+            self.assertRaises(ValueError, webserver.prefork.check_nonce_store, 2)
+            webserver.prefork.check_nonce_store(1)
+            webserver.nonces.NONCE_STORE = 'memory'
+            webserver.prefork.check_nonce_store(2)
+            webserver.validation.NONCE_STORE = webserver.nonces.ReplayWindowNonceStore(
+                webserver.nonces.MemoryNonceStore(), flush_interval=3600)
+            self.assertRaises(ValueError, webserver.prefork.check_nonce_store, 2)
+        finally:
+            webserver.nonces.NONCE_STORE, webserver.validation.NONCE_STORE = saved
@@ -0,0 +1,80 @@
+"""Tests for webserver.profiling module."""
+import os
+import tempfile
+import time
+import unittest
+
+import flask
+import stellar_base.keypair
+
+import webserver.profiling
+import webserver.validation
+
+
+def slow_handler():
+    """A handler worth profiling."""
+    time.sleep(.05)
+    return 'done'
+
+
+class TestProfiler(unittest.TestCase):
+    """Tests for Profiler class."""
+
+    def setUp(self):
+        """Prepare a profile directory and an operator key."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.keypair = stellar_base.keypair.Keypair.random()
+
+    def tearDown(self):
+        """Remove the profile directory."""
+        self.directory.cleanup()
+
+    def client(self, **kwargs):
+        """A test client of an app profiled with kwargs."""
+        app = flask.Flask('profiling_test')
+        app.add_url_rule('/slow', 'slow', slow_handler)
+        webserver.profiling.Profiler(self.directory.name, interval=.001, **kwargs).install(app)
+        return app.test_client()
+
+    def profile(self):
+        """The collapsed stacks written for the slow endpoint, or None."""
+        path = os.path.join(self.directory.name, 'slow.folded')
+        if not os.path.exists(path):
+            return None
+        with open(path) as profile_file:
+            return profile_file.read()
+
+    def test_rate(self):
+        """Test that sampled requests are profiled."""
+        self.client(rate=1).get('/slow')
+        self.assertIn('slow_handler', self.profile())
+
+    def test_signed_request(self):
+        """Test that only requests signed by the operator key are profiled."""
+        client = self.client(pubkey=self.keypair.address().decode())
+        timestamp = str(int(time.time() * 1000))
+        other_signature = webserver.validation.sign_fingerprint(
+            webserver.profiling.profile_request_data('/slow', timestamp),
+            stellar_base.keypair.Keypair.random().seed().decode())
+        client.get('/slow', headers={'Profile': timestamp, 'Profile-Signature': other_signature})
+        self.assertIsNone(self.profile())
+        signature = webserver.validation.sign_fingerprint(
+            webserver.profiling.profile_request_data('/slow', timestamp), self.keypair.seed().decode())
+        client.get('/slow', headers={'Profile': timestamp, 'Profile-Signature': signature})
+        self.assertIn('slow_handler', self.profile())
+        # A replayed profile request is refused.
+        os.remove(os.path.join(self.directory.name, 'slow.folded'))
+        client.get('/slow', headers={'Profile': timestamp, 'Profile-Signature': signature})
+        self.assertIsNone(self.profile())
+
+    def test_disabled(self):
+        """Test that a disabled profiler does not hook into the app."""
+        app = flask.Flask('profiling_test')
+        saved_debug, webserver.validation.DEBUG = webserver.validation.DEBUG, False
+        try:
+            profiler = webserver.profiling.Profiler(self.directory.name, rate=0, pubkey=None)
+            self.assertFalse(profiler.enabled)
+            profiler.install(app)
+        finally:
+            webserver.validation.DEBUG = saved_debug
+        self.assertEqual(app.before_request_funcs, {})
@@ -0,0 +1,93 @@
+"""Tests for webserver.ratelimit module."""
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+import limits.storage
+import limits.strategies
+
+import webserver.ratelimit
+
+
+def hit_shared_key(uri, hits):
+    """Hit a key from another process."""
+    storage = limits.storage.storage_from_string(uri)
+    for _ in range(hits):
+        storage.incr('shared', 60)
+
+
+class TestSharedMemoryStorage(unittest.TestCase):
+    """Tests for SharedMemoryStorage class."""
+
+    def setUp(self):
+        """Create a storage in a temporary file."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.uri = "paketshm://{}?buckets=64".format(os.path.join(self.directory.name, 'table'))
+        self.storage = limits.storage.storage_from_string(self.uri)
+
+    def tearDown(self):
+        """Remove the storage file."""
+        self.directory.cleanup()
+
+    def test_limit(self):
+        """Test limiting with the fixed window strategy."""
+        limiter = limits.strategies.FixedWindowRateLimiter(self.storage)
+        item = limits.parse('5 per minute')
+        self.assertEqual([limiter.hit(item, 'client') for _ in range(6)], [True] * 5 + [False])
+        self.assertTrue(limiter.hit(item, 'another_client'))
+        self.assertEqual(limiter.get_window_stats(item, 'client')[1], 0)
+
+    def test_sliding_window(self):
+        """Test that hits of the previous window count by how much it still overlaps."""
+        for _ in range(10):
+            self.storage.incr('key', 1)
+        time.sleep(1.5)
+        self.assertLessEqual(self.storage.get('key'), 5)
+        self.assertGreater(self.storage.get('key'), 0)
+        time.sleep(1)
+        self.assertEqual(self.storage.get('key'), 0)
+
+    def test_shared_between_processes(self):
+        """Test that processes share counters."""
+        processes = [multiprocessing.Process(target=hit_shared_key, args=(self.uri, 100)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.storage.get('shared'), 400)
+
+    def test_fixed_memory(self):
+        """Test that many keys evict old ones instead of growing the table."""
+        size = os.path.getsize(self.storage.path)
+        for index in range(64 * webserver.ratelimit.SLOTS_PER_BUCKET * 4):
+            self.storage.incr("key{}".format(index), 60)
+        self.assertEqual(os.path.getsize(self.storage.path), size)
+        self.assertEqual(self.storage.get("key{}".format(index)), 1)
+
+    def test_clear_and_reset(self):
+        """Test forgetting keys."""
+        self.storage.incr('key', 60)
+        self.storage.incr('another_key', 60)
+        self.storage.clear('key')
+        self.assertEqual(self.storage.get('key'), 0)
+        self.assertEqual(self.storage.get('another_key'), 1)
+        self.storage.reset()
+        self.assertEqual(self.storage.get('another_key'), 0)
+
+
+class TestPubkeyBudget(unittest.TestCase):
+    """Tests for PubkeyBudget class."""
+
+    def test_charge(self):
+        """Test that calls are charged by cost, per pubkey, with every storage."""
+        with tempfile.TemporaryDirectory() as directory:
+            for storage_uri in ['memory://', "paketshm://{}".format(os.path.join(directory, 'table'))]:
+                with self.subTest(storage_uri=storage_uri):
+                    budget = webserver.ratelimit.PubkeyBudget('10 per minute', storage_uri)
+                    budget.charge('pubkey', 4)
+                    budget.charge('pubkey', 6)
+                    with self.assertRaises(webserver.ratelimit.BudgetExceeded):
+                        budget.charge('pubkey', 1)
+                    budget.charge('another_pubkey', 10)
@@ -0,0 +1,65 @@
+"""Tests for webserver.serialization module."""
+import datetime
+import json
+import unittest
+
+import flask
+
+import webserver.serialization
+
+
+class TestDumps(unittest.TestCase):
+    """Tests for dumps function."""
+
+    def test_backends_agree(self):
+        """Test that all backends produce the same compact output."""
+        now = datetime.datetime.now()
+        obj = {'status': 200, 'time': now, 'list': [1, 'two', None, 3.5], 'nested': {'b': 1, 'a': now}}
+        outputs = {backend: webserver.serialization.dumps(obj, backend=backend)
+                   for backend in webserver.serialization.BACKENDS}
+        for backend, output in outputs.items():
+            with self.subTest(backend=backend):
+                self.assertEqual(output, outputs['json'])
+                self.assertEqual(json.loads(output.decode())['time'], int(now.timestamp()))
+                self.assertNotIn(b' ', output)
+
+    def test_big_integers(self):
+        """Test integers too big for 64 bits."""
+        for backend in webserver.serialization.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(webserver.serialization.dumps({'big': 2 ** 70}, backend=backend),
+                                 b'{"big":1180591620717411303424}')
+
+    def test_non_ascii(self):
+        """Test that all backends write non ASCII characters the same way, escaped or not."""
+        obj = {'city': 'Tel Aviv–Yafo', 'memo': 'שלום 📦'}
+        for ensure_ascii in [False, True]:
+            outputs = {backend: webserver.serialization.dumps(obj, backend=backend, ensure_ascii=ensure_ascii)
+                       for backend in webserver.serialization.BACKENDS}
+            for backend, output in outputs.items():
+                with self.subTest(backend=backend, ensure_ascii=ensure_ascii):
+                    self.assertEqual(output, outputs['json'])
+                    self.assertEqual(json.loads(output.decode()), obj)
+                    self.assertEqual(max(output) < 128, ensure_ascii)
+
+
+class TestResponse(unittest.TestCase):
+    """Tests for response function."""
+
+    def test_app_config(self):
+        """Test that the app's JSON configuration and encoder are followed."""
+
+        class Encoder(flask.json.JSONEncoder):
+            """Serialize sets as sorted lists."""
+
+            def default(self, o):  # pylint: disable=method-hidden
+                if isinstance(o, set):
+                    return sorted(o)
+                return super().default(o)
+
+        app = flask.Flask('serialization_test')
+        app.json_encoder = Encoder
+        app.config.update(JSON_SORT_KEYS=False, JSON_AS_ASCII=True)
+        with app.app_context():
+            response = webserver.serialization.response({'b': {2, 1}, 'a': '–'})
+        self.assertEqual(response.data, b'{"b":[1,2],"a":"\\u2013"}')
@@ -0,0 +1,82 @@
+"""Tests for webserver.static module."""
+import gzip
+import os
+import tempfile
+import unittest
+
+import flask
+
+import webserver.static
+
+
+class TestStaticIndex(unittest.TestCase):
+    """Tests for StaticIndex class."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare static directories and an app serving them."""
+        cls.directories = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+        files = [
+            (0, 'index.html', b'<html>first</html>'),
+            (1, 'index.html', b'<html>second</html>'),
+            (0, 'js/app.js', b'var big = 1;' * 100),
+            (0, 'js/app.js.gz', gzip.compress(b'var big = 1;' * 100))]
+        for directory_index, path, content in files:
+            full_path = os.path.join(cls.directories[directory_index].name, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as static_file:
+                static_file.write(content)
+        # The bundle is too big to be kept in memory.
+        index = webserver.static.StaticIndex([directory.name for directory in cls.directories], 100)
+        app = flask.Flask('static_test')
+
+        @app.route('/<path:path>')
+        # pylint: disable=unused-variable
+        def serve(path):
+            """Serve from the index."""
+            return index.response(path) or ('missing', 404)
+
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the static directories."""
+        for directory in cls.directories:
+            directory.cleanup()
+
+    def test_precedence(self):
+        """Test that earlier directories win."""
+        response = self.client.get('/index.html')
+        self.assertEqual(response.data, b'<html>first</html>')
+        self.assertEqual(response.mimetype, 'text/html')
+
+    def test_miss(self):
+        """Test that unindexed paths are not served."""
+        for path in ['/missing.html', '/../index.html', '/js']:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_added_file(self):
+        """Test that files added after the index was built are served."""
+        with open(os.path.join(self.directories[1].name, 'added.html'), 'wb') as static_file:
+            static_file.write(b'<html>added</html>')
+        response = self.client.get('/added.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'<html>added</html>')
+        self.assertEqual(response.mimetype, 'text/html')
+
+    def test_not_modified(self):
+        """Test conditional requests."""
+        etag = self.client.get('/index.html').headers['ETag']
+        response = self.client.get('/index.html', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_precompressed(self):
+        """Test that precompressed variants are picked by Accept-Encoding."""
+        response = self.client.get('/js/app.js', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), b'var big = 1;' * 100)
+        response = self.client.get('/js/app.js')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, b'var big = 1;' * 100)
@@ -3,3 +3,19 @@
 # pylint: disable=unused-wildcard-import
 from tests.validation_test import *
 from tests.webserver_test import *
+from tests.nonces_test import *
+from tests.verifiers_test import *
+from tests.asgi_test import *
+from tests.static_test import *
+from tests.serialization_test import *
+from tests.ratelimit_test import *
+from tests.metrics_test import *
+from tests.profiling_test import *
+from tests.benchmark_test import *
+from tests.loadgen_test import *
+from tests.prefork_test import *
+from tests.openapi_test import *
+from tests.cache_test import *
+from tests.logs_test import *
+from tests.batch_test import *
+from tests.compression_test import *
@@ -1,10 +1,14 @@
 """Tests for webserver.validation module."""
+import io
+import json
 import unittest
 import time
 
+import flask
 import stellar_base.keypair
 import util.logger
 
+import tests.fixtures
 import webserver
 
 LOGGER = util.logger.logging.getLogger('pkt.webserver.test')
@@ -63,6 +67,35 @@ class TestGenerateFingerprint(unittest.TestCase):
                 self.assertRegex(fingerprint, r'^(\/[\w]+)+,([\w]+=[\w]+,)*([0-9]{13})$')
 
 
+class TestParseFingerprint(unittest.TestCase):
+    """Tests for parse_fingerprint function"""
+
+    def test_round_trip(self):
+        """Test that generated fingerprints parse back, delimiters in values included."""
+        kwargs = {'memo': 'a,b=c\\d', 'signature': 'c2lnbmF0dXJl==', 'amount_nat': 10}
+        for compact in [False, True]:
+            with self.subTest(compact=compact):
+                fingerprint = webserver.validation.generate_fingerprint(
+                    'http://host/v3/uri?arg=1,2', kwargs, compact, 1528265594985)
+                url, pairs, nonce = webserver.validation.parse_fingerprint(fingerprint)
+                self.assertEqual(url, 'http://host/v3/uri?arg=1,2')
+                self.assertEqual(dict(pairs), {key: str(value) for key, value in kwargs.items()})
+                self.assertEqual(nonce, '1528265594985')
+
+    def test_compact_is_canonical(self):
+        """Test that compact fingerprints do not depend on argument order."""
+        self.assertEqual(
+            webserver.validation.generate_fingerprint('/v3/uri', {'a': 1, 'b': 2}, True, 1),
+            webserver.validation.generate_fingerprint('/v3/uri', {'b': 2, 'a': 1}, True, 1))
+
+    def test_malformed(self):
+        """Test malformed fingerprints."""
+        for fingerprint in ['/v3/uri,arg,1528265594985', '$1:7:/v3/uri', '$1:99:/v3/uri1:1',
+                            '$1:-3:', '$1: 3:', '$1:+3:', '$1:03:abc1:1']:
+            with self.subTest(fingerprint=fingerprint), self.assertRaises(webserver.validation.FingerprintMismatch):
+                webserver.validation.parse_fingerprint(fingerprint)
+
+
 class TestCheckFingerprint(unittest.TestCase):
     """Tests for check_fingerprint function"""
 
@@ -102,6 +135,25 @@ class TestCheckFingerprint(unittest.TestCase):
             with self.subTest(**data):
                 webserver.validation.check_fingerprint(**data)
 
+    def test_check_compact_fingerprint(self):
+        """Test the check_fingerprint function with a compact fingerprint."""
+        kwargs = {'escrow_pubkey': 'GAM7BELNXMX5I3CQRGQAFAYF73FMT7CV2RJHUPEYAIINT5YJ726UY2GG', 'memo': 'a,b=c'}
+        webserver.validation.check_fingerprint(
+            stellar_base.keypair.Keypair.random().address().decode(),
+            webserver.validation.generate_fingerprint('/v3/accept_package', kwargs, compact=True),
+            '/v3/accept_package', kwargs)
+
+    def test_legacy_backslash(self):
+        """Test that backslashes in legacy fingerprints are taken literally, as they always were."""
+        kwargs = {'memo': 'C:\\temp'}
+        for fingerprint in [
+                # As generated before escaping was introduced.
+                "/v3/uri,memo=C:\\temp,{:.0f}".format(time.time() * 1000),
+                webserver.validation.generate_fingerprint('/v3/uri', kwargs)]:
+            with self.subTest(fingerprint=fingerprint):
+                webserver.validation.check_fingerprint(
+                    stellar_base.keypair.Keypair.random().address().decode(), fingerprint, '/v3/uri', kwargs)
+
     def test_mismatch(self):
         """Test fingerprint mismatch."""
         data_set = [
@@ -186,6 +238,18 @@ class TestCheckFingerprint(unittest.TestCase):
             webserver.validation.check_fingerprint(user_pubkey, fingerprint, url, kwargs)
         self.assertTrue(str(execution_context.exception).endswith('is not bigger than current nonce'))
 
+    def test_bytes_pubkey_memory_store(self):
+        """Test that bytes pubkeys are accepted by every store, not only by MySQL."""
+        saved_store, webserver.validation.NONCE_STORE = webserver.validation.NONCE_STORE, \
+            webserver.nonces.MemoryNonceStore()
+        try:
+            user_pubkey = stellar_base.keypair.Keypair.random().address()
+            webserver.validation.update_nonce(user_pubkey, 1)
+            self.assertRaises(webserver.validation.InvalidNonce, webserver.validation.update_nonce,
+                              user_pubkey.decode(), 1)
+        finally:
+            webserver.validation.NONCE_STORE = saved_store
+
 
 class TestSignFingerprint(unittest.TestCase):
     """Tests for sign_fingerprint function"""
@@ -233,6 +297,21 @@ class TestCheckSignature(unittest.TestCase):
                 webserver.validation.check_signature(**data)
 
 
+class TestPubkeyCache(unittest.TestCase):
+    """Tests for the pubkey cache shared by check_pubkey and check_signature"""
+
+    def test_cache(self):
+        """Test that a checked pubkey is served from the cache when its signature is checked."""
+        keypair = stellar_base.keypair.Keypair.random()
+        pubkey = keypair.address().decode()
+        fingerprint = '/v3/some/uri,1528265594985'
+        signature = webserver.validation.sign_fingerprint(fingerprint, keypair.seed().decode())
+        webserver.validation.check_pubkey('some_pubkey', pubkey)
+        hits = webserver.verifiers.load_key.cache_info().hits
+        webserver.validation.check_signature(pubkey, fingerprint, signature)
+        self.assertEqual(webserver.verifiers.load_key.cache_info().hits, hits + 1)
+
+
 class TestCheckAndFix(unittest.TestCase):
     """Tests for check_and_fix_values function"""
 
@@ -296,3 +375,102 @@ class TestCheckAndFix(unittest.TestCase):
         }
         with self.assertRaises(webserver.validation.InvalidField):
             webserver.validation.check_and_fix_values(kwargs)
+
+
+class TestCallPlan(unittest.TestCase):
+    """Tests for CallPlan class"""
+
+    @staticmethod
+    def handler(user_pubkey, amount_nat, memo=None):
+        """A handler to plan for."""
+        return user_pubkey, amount_nat, memo
+
+    def test_fields(self):
+        """Test detection of missing and extra fields."""
+        plan = webserver.validation.CallPlan(self.handler, require_auth=True)
+        plan.check_fields({'amount_nat'})
+        plan.check_fields({'amount_nat', 'memo'})
+        with self.assertRaises(webserver.validation.MissingFields):
+            plan.check_fields({'memo'})
+        with self.assertRaises(webserver.validation.ExtraField):
+            plan.check_fields({'amount_nat', 'amount'})
+
+    def test_required_fields(self):
+        """Test that explicitly required fields are required too."""
+        plan = webserver.validation.CallPlan(self.handler, ['memo'], require_auth=True)
+        with self.assertRaises(webserver.validation.MissingFields):
+            plan.check_fields({'amount_nat'})
+
+    def test_fix_values(self):
+        """Test that bound fixers are applied."""
+        plan = webserver.validation.CallPlan(self.handler, require_auth=True)
+        self.assertEqual(plan.fix_values({'amount_nat': '5', 'memo': '5'}), {'amount_nat': 5, 'memo': '5'})
+        with self.assertRaises(webserver.validation.InvalidField):
+            plan.fix_values({'amount_nat': '-5'})
+
+    def test_accepts_any(self):
+        """Test that handlers taking **kwargs accept and fix any field."""
+        plan = webserver.validation.CallPlan(lambda **kwargs: kwargs)
+        plan.check_fields({'anything', 'count_nat'})
+        self.assertEqual(plan.fix_values({'count_nat': '3'}), {'count_nat': 3})
+
+
+class TestUploads(unittest.TestCase):
+    """Tests for file uploads"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare an app with an upload endpoint per upload mode."""
+        app = flask.Flask('uploads_test')
+        for mode in webserver.validation.UPLOAD_MODES:
+            def upload_handler(upload, mode=mode):
+                """Report what the handler got."""
+                return {'status': 200, 'mode': mode, 'content': bytes(
+                    upload.read() if mode == 'stream' else upload).decode()}
+            app.add_url_rule(
+                "/{}".format(mode), mode, webserver.validation.call(upload_mode=mode, max_upload_size=1024)(
+                    upload_handler), methods=['POST'])
+        cls.client = app.test_client()
+
+    def test_modes(self):
+        """Test that every mode hands over the file content."""
+        for mode in webserver.validation.UPLOAD_MODES:
+            with self.subTest(mode=mode):
+                response = self.client.post("/{}".format(mode), data={'upload': (io.BytesIO(b'content'), 'file')})
+                self.assertEqual(json.loads(response.data.decode())['content'], 'content')
+
+    def test_too_big(self):
+        """Test that big uploads are refused."""
+        response = self.client.post('/stream', data={'upload': (io.BytesIO(b'0' * 2048), 'file')})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data.decode())['error']['internal_error_code'], 105)
+
+
+class TestChargeAfterNonce(unittest.TestCase):
+    """Tests for charging the pubkey budget of authenticated calls."""
+
+    def setUp(self):
+        """Use in memory nonces and a budget of a single call."""
+        self.authentication = tests.fixtures.authentication('1 per minute')
+        self.app = flask.Flask('charge_test')
+        self.keypair = stellar_base.keypair.Keypair.random()
+
+    def tearDown(self):
+        """Restore the configuration."""
+        self.authentication.close()
+
+    def check_call(self, nonce):
+        """Check a signed call with a nonce."""
+        fingerprint = webserver.validation.generate_fingerprint('http://localhost/v3/call', {}, nonce=nonce)
+        headers = {
+            'Pubkey': self.keypair.address().decode(), 'Fingerprint': fingerprint,
+            'Signature': webserver.validation.sign_fingerprint(fingerprint, self.keypair.seed().decode())}
+        with self.app.test_request_context('/v3/call', headers=headers):
+            return webserver.validation.check_and_fix_call(flask.request, None, True)
+
+    def test_replay_not_charged(self):
+        """Test that replays of a call are refused without charging the budget of its pubkey."""
+        self.check_call(1)
+        for _ in range(3):
+            self.assertRaises(webserver.validation.FingerprintMismatch, self.check_call, 1)
+        self.assertRaises(webserver.ratelimit.BudgetExceeded, self.check_call, 2)
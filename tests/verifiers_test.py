@@ -0,0 +1,81 @@
+"""Tests for webserver.verifiers module."""
+import base64
+import unittest
+
+import webserver.verifiers
+
+PUBKEY = 'GAXPE5KLZEYRU2GPBQHS2HWNBG7I5EI7CSUP3DGDEZH7CJPYEM2I6ADQ'
+DATA = b'/v3/some/uri,arg=qwerty,1528265594985'
+SIGNATURE = base64.b64decode(
+    'GFQSrZc91ocbelD246doUpMkGbsTD8vO/hIV9P4oetHU4Kl4Xbb5AaEDarlHLYbxGKGl6cO6hriK+Zeox29pAg==')
+
+
+class TestBackends(unittest.TestCase):
+    """Tests that all installed backends agree."""
+
+    def test_valid_signature(self):
+        """Test that every backend accepts a valid signature."""
+        for backend in webserver.verifiers.available_backends():
+            with self.subTest(backend=backend.name):
+                backend.verify(backend.load(PUBKEY), DATA, SIGNATURE)
+
+    def test_invalid_signature(self):
+        """Test that every backend rejects tampered data and signatures."""
+        data_set = [
+            {'data': DATA + b'0', 'signature': SIGNATURE},
+            {'data': DATA, 'signature': SIGNATURE[:-1] + b'\0'},
+        ]
+        for backend in webserver.verifiers.available_backends():
+            for data in data_set:
+                with self.subTest(backend=backend.name, **data), self.assertRaises(
+                        webserver.verifiers.BadSignature):
+                    backend.verify(backend.load(PUBKEY), **data)
+
+
+class TestVerify(unittest.TestCase):
+    """Tests for verify function."""
+
+    def test_malformed(self):
+        """Test that malformed pubkeys and signatures are rejected."""
+        data_set = [
+            {'address': PUBKEY, 'data': DATA, 'signature': SIGNATURE[:-1]},
+            {'address': 'not a pubkey', 'data': DATA, 'signature': SIGNATURE},
+        ]
+        for data in data_set:
+            with self.subTest(**data), self.assertRaises(webserver.verifiers.BadSignature):
+                webserver.verifiers.verify(**data)
+
+    def test_malleated(self):
+        """Test that every backend rejects a valid signature with the group order added to its S half."""
+        scalar = int.from_bytes(SIGNATURE[32:], 'little') + webserver.verifiers.GROUP_ORDER
+        malleated = SIGNATURE[:32] + scalar.to_bytes(32, 'little')
+        saved_backend = webserver.verifiers.BACKEND
+        try:
+            for backend in webserver.verifiers.available_backends():
+                webserver.verifiers.BACKEND = backend
+                webserver.verifiers.load_key.cache_clear()
+                with self.subTest(backend=backend.name), self.assertRaises(webserver.verifiers.BadSignature):
+                    webserver.verifiers.verify_inline(PUBKEY, DATA, malleated)
+        finally:
+            webserver.verifiers.BACKEND = saved_backend
+            webserver.verifiers.load_key.cache_clear()
+
+    def test_benchmark(self):
+        """Test that the benchmark measures every installed backend."""
+        results = webserver.verifiers.benchmark(iterations=3)
+        self.assertEqual(
+            set(results), {backend.name for backend in webserver.verifiers.available_backends()})
+
+
+class TestOffloadPool(unittest.TestCase):
+    """Tests for OffloadPool class."""
+
+    def test_offload(self):
+        """Test verification on thread and process pools."""
+        for mode in ['thread', 'process']:
+            pool = webserver.verifiers.OffloadPool(2, mode, 2, 1)
+            with self.subTest(mode=mode):
+                pool.verify(PUBKEY, DATA, SIGNATURE)
+                with self.assertRaises(webserver.verifiers.BadSignature):
+                    pool.verify(PUBKEY, DATA + b'0', SIGNATURE)
+            pool.executor.shutdown()
@@ -1,8 +1,15 @@
 """Tests for webserver package."""
+import json
+import os
+import subprocess
+import sys
 import unittest
 import flask
 import webserver
 
+# Seconds importing the package may take in a fresh interpreter.
+IMPORT_TIME_BUDGET = float(os.environ.get('PAKET_IMPORT_TIME_BUDGET', 2))
+
 
 class TestWebserver(unittest.TestCase):
     """Testing webserver."""
@@ -30,3 +37,35 @@ class TestWebserver(unittest.TestCase):
     def tearDownClass(cls):
         """Terminates web server process"""
         del cls._client
+
+
+class TestCreateApp(unittest.TestCase):
+    """Tests for create_app function."""
+
+    def test_independent_apps(self):
+        """Test that differently configured apps live side by side."""
+        clients = []
+        for config in [{'RATELIMIT_DEFAULT': '1 per minute'}, None]:
+            app = webserver.create_app(config)
+            app.add_url_rule('/ping', 'ping', lambda: 'pong')
+            clients.append(app.test_client())
+        limited_client, client = clients
+        self.assertEqual(limited_client.get('/ping').status_code, 200)
+        response = limited_client.get('/ping')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(json.loads(response.data.decode())['code'], 429)
+        self.assertEqual(client.get('/ping').status_code, 200)
+        self.assertEqual(client.get('/ping').status_code, 200)
+
+    def test_lazy_import(self):
+        """Test that importing the package builds no app and skips flasgger, within the time budget."""
+        output = subprocess.check_output([sys.executable, '-c', '\n'.join([
+            'import sys, time',
+            'start = time.perf_counter()',
+            'import webserver',
+            "print(time.perf_counter() - start, 'flasgger' in sys.modules, webserver.DEFAULT_APP is not None)"])],
+                                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        seconds, flasgger_imported, app_created = output.decode().split()
+        self.assertLess(float(seconds), IMPORT_TIME_BUDGET)
+        self.assertEqual(flasgger_imported, 'False')
+        self.assertEqual(app_created, 'False')
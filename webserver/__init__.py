@@ -1,23 +1,35 @@
 """PAKET Web Server."""
 import datetime
 import os
+import threading
 
-import flasgger
 import flask
 import flask_cors
 import flask_limiter.util
+import werkzeug.local
 
 import util.logger
 
+import webserver.batch
+import webserver.compression
+import webserver.logs
+import webserver.metrics
+import webserver.openapi
+import webserver.profiling
+import webserver.ratelimit
+import webserver.serialization
+import webserver.static
 import webserver.validation
 
 LOGGER = util.logger.logging.getLogger('pkt.web')
-APP = flask.Flask('PaKeT')
-flask_cors.CORS(APP)
-APP.config['SECRET_KEY'] = os.environ.get('PAKET_SESSIONS_KEY', os.urandom(24))
 STATIC_DIRS = ['static']
+STATIC_INDEX = None
 DEFAULT_LIMIT = os.environ.get('PAKET_SERVER_LIMIT', '100 per minute')
-LIMITER = flask_limiter.Limiter(APP, key_func=flask_limiter.util.get_remote_address, default_limits=[DEFAULT_LIMIT])
+# Set to paketshm:// (see webserver.ratelimit) to share limits between the worker processes of a host.
+LIMITER_STORAGE = os.environ.get('PAKET_LIMITER_STORAGE', 'memory://')
+# Created on first use, see get_app.
+DEFAULT_APP = None
+DEFAULT_APP_LOCK = threading.Lock()
 
 
 class PaketJSONEncoder(flask.json.JSONEncoder):
@@ -32,33 +44,94 @@ class PaketJSONEncoder(flask.json.JSONEncoder):
     # pylint: enable=wildcard-import
 
 
-APP.json_encoder = PaketJSONEncoder
+def create_app(config=None):
+    """
+    Create an app with CORS and a rate limiter, config overriding the settings taken from the environment.
+    The limiter is configured by the RATELIMIT_* keys of Flask-Limiter.
+    Responses are compressed according to webserver.compression.
+    """
+    app = flask.Flask('PaKeT')
+    app.config['SECRET_KEY'] = os.environ.get('PAKET_SESSIONS_KEY', os.urandom(24))
+    app.config['RATELIMIT_DEFAULT'] = DEFAULT_LIMIT
+    app.config['RATELIMIT_STORAGE_URL'] = LIMITER_STORAGE
+    app.config.update(config or {})
+    app.json_encoder = PaketJSONEncoder
+    flask_cors.CORS(app)
+    flask_limiter.Limiter(app, key_func=flask_limiter.util.get_remote_address)
+    app.register_error_handler(429, ratelimit_handler)
+    if webserver.compression.COMPRESS:
+        app.wsgi_app = webserver.compression.CompressionMiddleware(app.wsgi_app)
+    return app
 
 
-def setup(blueprint=None, swagger_config=None):
-    """Register blueprint, flasgger, and catchall."""
+def get_app():
+    """Get the default app, creating it on first use."""
+    global DEFAULT_APP  # pylint: disable=global-statement
+    if DEFAULT_APP is None:
+        with DEFAULT_APP_LOCK:
+            if DEFAULT_APP is None:
+                DEFAULT_APP = create_app()
+    return DEFAULT_APP
+
+
+def get_limiter(app=None):
+    """Get the rate limiter of app, or of the default app."""
+    return (app or get_app()).extensions['limiter']
+
+
+# The default app and its limiter, only created when first used.
+APP = werkzeug.local.LocalProxy(get_app)
+LIMITER = werkzeug.local.LocalProxy(get_limiter)
+
+
+def setup(blueprint=None, swagger_config=None, app=None):
+    """Register blueprint, flasgger, and catchall on app, or on the default app."""
+    global STATIC_INDEX  # pylint: disable=global-statement
+    app = app or get_app()
+    static_index = STATIC_INDEX = webserver.static.StaticIndex(STATIC_DIRS)
+    static_index.start_refresh()
+    if webserver.logs.ASYNC_LOGGING:
+        webserver.logs.install()
+    webserver.profiling.Profiler().install(app)
     if blueprint:
-        APP.register_blueprint(blueprint)
+        app.register_blueprint(blueprint)
     if swagger_config:
-        APP.config['SWAGGER'] = swagger_config
-        flasgger.Swagger(APP)
+        # Flasgger is slow to import, and only needed by apps that serve a spec.
+        import flasgger
+        app.config['SWAGGER'] = swagger_config
+        webserver.openapi.install(app, flasgger.Swagger(app))
+    if webserver.batch.BATCH_ROUTE:
+        app.add_url_rule(webserver.batch.BATCH_ROUTE, 'batch', webserver.batch.batch_handler, methods=['POST'])
+    if webserver.metrics.METRICS_ROUTE:
+        app.add_url_rule(webserver.metrics.METRICS_ROUTE, 'metrics', metrics_handler)
 
-    @APP.route('/')
-    @APP.route('/<path:path>', methods=['GET', 'POST'])
+    @app.route('/')
+    @app.route('/<path:path>', methods=['GET', 'POST'])
     # pylint: disable=unused-variable
     def catch_all_handler(path='index.html'):
         """All undefined endpoints try to serve from the static directories."""
-        for directory in STATIC_DIRS:
-            if os.path.isfile(os.path.join(directory, path)):
-                return flask.send_from_directory(directory, path)
+        response = static_index.response(path)
+        if response is not None:
+            return response
         return flask.jsonify({'status': 403, 'error': "Forbidden path: {}".format(path)}), 403
 
-    return APP
+    if webserver.openapi.OPENAPI_PRECOMPUTE:
+        webserver.openapi.precompute(app)
+    return app
+
+
+def metrics_handler():
+    """Export the metrics for scraping, to scrapers with the token if one is configured."""
+    if not webserver.metrics.authorized(flask.request.headers.get('Authorization')):
+        return flask.jsonify({'status': 403, 'error': 'Forbidden path: metrics'}), 403
+    return flask.current_app.response_class(
+        webserver.metrics.REGISTRY.render(), content_type=webserver.metrics.CONTENT_TYPE)
 
 
-@APP.errorhandler(429)
 def ratelimit_handler(error):
     """Custom error for rate limiter."""
+    webserver.metrics.RATE_LIMITED.inc()
     msg = 'Rate limit exceeded. Allowed rate: {}'.format(error.description)
-    LOGGER.info(msg)
-    return flask.make_response(flask.jsonify({'code': 429, 'error': msg}), 429)
+    LOGGER.info("%s", webserver.logs.KeyValues(
+        event='rate_limited', limit=error.description, path=flask.request.path, remote=flask.request.remote_addr))
+    return webserver.serialization.response({'code': 429, 'error': msg}, 429)
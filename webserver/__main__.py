@@ -1,4 +1,5 @@
 """Run test webserver."""
+import argparse
 import sys
 import os.path
 
@@ -8,6 +9,8 @@ import flask
 # Python imports are silly.
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 # pylint: disable=wrong-import-position
+import webserver.openapi
+import webserver.prefork
 import webserver.validation
 # pylint: enable=wrong-import-position
 
@@ -116,8 +119,14 @@ def check_signature_handler(user_pubkey):
     return {'status': 200, 'message': "signature verified for {}".format(user_pubkey)}
 
 
-try:
-    PORT = int(sys.argv[1])
-except (IndexError, ValueError):
-    PORT = 5000
-webserver.setup(BLUEPRINT, SWAGGER_CONFIG).run('0.0.0.0', PORT, webserver.validation.DEBUG)
+PARSER = argparse.ArgumentParser(description=__doc__)
+PARSER.add_argument('port', nargs='?', type=int, default=5000)
+PARSER.add_argument('--dump-openapi', metavar='DIRECTORY', help='write the api spec into a directory and exit')
+webserver.prefork.add_arguments(PARSER)
+ARGS = PARSER.parse_args()
+APP = webserver.setup(BLUEPRINT, SWAGGER_CONFIG)
+if ARGS.dump_openapi:
+    webserver.openapi.dump(APP, ARGS.dump_openapi)
+else:
+    webserver.prefork.run(
+        APP, '0.0.0.0', ARGS.port, ARGS.workers, ARGS.max_requests, ARGS.reuse_port, webserver.validation.DEBUG)
@@ -0,0 +1,190 @@
+"""Async API calls, served from ASGI servers or from Flask."""
+import asyncio
+import concurrent.futures
+import functools
+import io
+import os
+import sys
+import threading
+
+import flask
+import werkzeug.wrappers
+
+import util.db
+
+import webserver.serialization
+import webserver.validation
+
+# Blocking validation work (nonce commits, signature checks) runs here, off the event loop.
+ASYNC_WORKERS = int(os.environ.get('PAKET_ASYNC_WORKERS', 16))
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(ASYNC_WORKERS)
+LOCAL = threading.local()
+
+
+def after_fork():
+    """Replace the executor inherited from the parent process, its threads did not survive the fork."""
+    global EXECUTOR  # pylint: disable=global-statement
+    EXECUTOR = concurrent.futures.ThreadPoolExecutor(ASYNC_WORKERS)
+
+
+def environ_from_scope(scope, body):
+    """Build a WSGI environ from an ASGI HTTP scope and its body."""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': "HTTP/{}".format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False}
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        name = "HTTP_{}".format(name)
+        environ[name] = "{},{}".format(environ[name], value) if name in environ else value
+    return environ
+
+
+def declared_length(scope):
+    """The content length declared by the headers of an ASGI scope, None if not declared."""
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def request_from_asgi(scope, receive, max_size=None):
+    """
+    Read an ASGI request into a werkzeug request, which is what validation expects.
+    Bodies declared or found to be bigger than max_size bytes are refused before they are read whole.
+    """
+    if max_size is not None and (declared_length(scope) or 0) > max_size:
+        raise util.db.DataTooBig("request is bigger than {} bytes".format(max_size))
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if max_size is not None and len(body) > max_size:
+            raise util.db.DataTooBig("request is bigger than {} bytes".format(max_size))
+        more_body = message.get('more_body', False)
+    return werkzeug.wrappers.Request(environ_from_scope(scope, bytes(body)))
+
+
+async def serve_lifespan(receive, send):
+    """Acknowledge the lifespan events of an ASGI server, calls have nothing to start or stop."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+class AsyncCall:
+    """
+    An API call with an async handler.
+    Instances are ASGI applications, and flask_view gives a view function for Flask routes.
+    """
+
+    def __init__(self, handler, required_fields=None, require_auth=None,
+                 upload_mode='bytes', max_upload_size=webserver.validation.MAX_UPLOAD_SIZE, cost=1):
+        functools.update_wrapper(self, handler)
+        self.handler = handler
+        self.required_fields = required_fields
+        self.require_auth = require_auth or False
+        self.plan = webserver.validation.CallPlan(
+            handler, required_fields, self.require_auth, upload_mode, max_upload_size, cost)
+
+    async def handle(self, request):
+        """Validate the request and run the handler, returning a response dict like call does."""
+        loop = asyncio.get_event_loop()
+        kwargs = {}
+        # pylint: disable=broad-except
+        # If anything fails, we want to catch it here.
+        try:
+            kwargs = await loop.run_in_executor(
+                EXECUTOR, webserver.validation.check_and_fix_call,
+                request, self.required_fields, self.require_auth, self.plan)
+            if asyncio.iscoroutinefunction(self.handler):
+                response = await self.handler(**kwargs)
+            else:
+                response = await loop.run_in_executor(EXECUTOR, functools.partial(self.handler, **kwargs))
+        except Exception as exception:
+            response = webserver.validation.error_response(exception, request)
+        # pylint: enable=broad-except
+        webserver.validation.close_uploads(kwargs)
+        if 'error' in response:
+            webserver.validation.log_error(self.handler.__name__, response)
+        return response
+
+    async def __call__(self, scope, receive, send):
+        """Serve as an ASGI application, of HTTP requests only."""
+        if scope['type'] == 'lifespan':
+            await serve_lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        try:
+            request = await request_from_asgi(scope, receive, self.plan.max_upload_size)
+        except util.db.DataTooBig as exception:
+            # Only unknown exceptions, with status 500, need the request for logging.
+            response = webserver.validation.error_response(exception, None)
+            webserver.validation.log_error(self.handler.__name__, response)
+        else:
+            response = await self.handle(request)
+        body = webserver.serialization.dumps(response)
+        await send({
+            'type': 'http.response.start',
+            'status': response.get('status', 200),
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def run(self, request):
+        """Handle a request to completion on this thread's event loop."""
+        try:
+            loop = LOCAL.loop
+        except AttributeError:
+            loop = LOCAL.loop = asyncio.new_event_loop()
+        return loop.run_until_complete(self.handle(request))
+
+    @property
+    def flask_view(self):
+        """A synchronous view function for a Flask route."""
+        @functools.wraps(self.handler)
+        def _view(*_, **__):
+            # The request proxy is bound to this thread, validation may run on another one.
+            # pylint: disable=protected-access
+            response = self.run(flask.request._get_current_object())
+            # pylint: enable=protected-access
+            return webserver.serialization.response(response, response.get('status', 200))
+        return _view
+
+
+# Since this is a decorator the handler argument will never be None, it is
+# defined as such only to comply with python's syntactic sugar.
+@webserver.validation.optional_arg_decorator
+def call(handler=None, required_fields=None, require_auth=None,
+         upload_mode='bytes', max_upload_size=webserver.validation.MAX_UPLOAD_SIZE, cost=1):
+    """
+    The async counterpart of webserver.validation.call, accepting async def handlers.
+    Returns an AsyncCall, use its flask_view attribute to route it from Flask.
+    """
+    return AsyncCall(handler, required_fields, require_auth, upload_mode, max_upload_size, cost)
@@ -0,0 +1,98 @@
+"""Many API calls in one signed request."""
+import concurrent.futures
+import json
+import os
+
+import flask
+import werkzeug.test
+import werkzeug.wrappers
+
+import webserver.validation
+
+# Route of the batch endpoint registered by webserver.setup, e.g. /batch. Not registered unless set.
+BATCH_ROUTE = os.environ.get('PAKET_BATCH_ROUTE', '')
+BATCH_MAX_CALLS = int(os.environ.get('PAKET_BATCH_MAX_CALLS', 20))
+# Independent GET sub-calls run concurrently here.
+BATCH_WORKERS = int(os.environ.get('PAKET_BATCH_WORKERS', 8))
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(BATCH_WORKERS)
+METHODS = ('GET', 'POST')
+
+
+def after_fork():
+    """Replace the executor inherited from the parent process, its threads did not survive the fork."""
+    global EXECUTOR  # pylint: disable=global-statement
+    EXECUTOR = concurrent.futures.ThreadPoolExecutor(BATCH_WORKERS)
+
+
+def parse_calls(calls):
+    """Parse and check the JSON list of sub-calls, each an object with path, and optional method and args."""
+    try:
+        calls = json.loads(calls)
+    except ValueError:
+        raise webserver.validation.InvalidField("calls must be a JSON list")
+    if not isinstance(calls, list) or not calls or len(calls) > BATCH_MAX_CALLS:
+        raise webserver.validation.InvalidField("calls must be a list of 1 to {} calls".format(BATCH_MAX_CALLS))
+    parsed_calls = []
+    for index, sub_call in enumerate(calls):
+        if not isinstance(sub_call, dict) or not isinstance(sub_call.get('path'), str) or \
+                not sub_call['path'].startswith('/') or sub_call.get('method', 'GET') not in METHODS or \
+                not isinstance(sub_call.get('args', {}), dict):
+            raise webserver.validation.InvalidField(
+                "call {} must have a path, and may have a method out of {} and an args object".format(
+                    index, ', '.join(METHODS)))
+        parsed_calls.append((sub_call.get('method', 'GET'), sub_call['path'], sub_call.get('args', {})))
+    return parsed_calls
+
+
+def run_sub_call(app, user_pubkey, remote_addr, method, path, args):
+    """Dispatch a sub-call through app as user_pubkey, returning its status and body."""
+    args = {key: value if isinstance(value, str) else json.dumps(value) for key, value in args.items()}
+    environ = werkzeug.test.EnvironBuilder(
+        path=path, method=method, headers={'Pubkey': user_pubkey}, environ_base={'REMOTE_ADDR': remote_addr},
+        **{'query_string' if method == 'GET' else 'data': args}).get_environ()
+    environ[webserver.validation.AUTHENTICATED_PUBKEY] = user_pubkey
+    # pylint: disable=broad-except
+    # A failing sub-call should fail alone.
+    try:
+        with app.request_context(environ):
+            response = app.full_dispatch_request()
+            body = response.get_json(silent=True)
+            return {'status': response.status_code, 'body': response.get_data(True) if body is None else body}
+    except Exception as exception:
+        response = webserver.validation.error_response(exception, werkzeug.wrappers.Request(environ))
+        return {'status': response['status'], 'body': response}
+    # pylint: enable=broad-except
+
+
+def run_calls(app, user_pubkey, remote_addr, calls):
+    """
+    Run sub-calls, returning their results in order.
+    GET sub-calls between POSTs run concurrently, and every POST runs alone, after the calls before it.
+    """
+    results = [None] * len(calls)
+    pending = []
+    for index, (method, path, args) in enumerate(calls):
+        if method == 'GET':
+            pending.append((index, EXECUTOR.submit(run_sub_call, app, user_pubkey, remote_addr, method, path, args)))
+            continue
+        for pending_index, future in pending:
+            results[pending_index] = future.result()
+        pending = []
+        results[index] = run_sub_call(app, user_pubkey, remote_addr, method, path, args)
+    for pending_index, future in pending:
+        results[pending_index] = future.result()
+    return results
+
+
+@webserver.validation.call(['calls'], require_auth=True)
+def batch_handler(user_pubkey, calls):
+    """
+    Run a JSON list of calls, authenticated by the single signature of the batch.
+    Each call is an object with a path, a method (GET or POST, defaults to GET) and args.
+    Responds with a list of results in the same order, each with the status and body of a call.
+    """
+    if webserver.validation.AUTHENTICATED_PUBKEY in flask.request.environ:
+        raise webserver.validation.InvalidField("batches can not be nested")
+    return {'status': 200, 'results': run_calls(
+        flask.current_app._get_current_object(),  # pylint: disable=protected-access
+        user_pubkey, flask.request.remote_addr, parse_calls(calls))}
@@ -0,0 +1,90 @@
+"""Response cache for idempotent calls."""
+import collections
+import hashlib
+import os
+import threading
+import time
+
+import webserver.metrics
+
+# Responses kept by every cached handler.
+CACHE_SIZE = int(os.environ.get('PAKET_CACHE_SIZE', 1024))
+# Caches by the qualified names of their handlers, for invalidation.
+CACHES = {}
+# Only idempotent requests are answered from the cache.
+CACHED_METHODS = ('GET', 'HEAD')
+CACHE_REQUESTS = webserver.metrics.REGISTRY.counter(
+    'paket_cache_requests_total', 'Response cache lookups.', ['endpoint', 'result'])
+
+
+def cache_name(handler):
+    """The qualified name of a handler, unique where plain names are reused, e.g. by versioned blueprints."""
+    return "{}.{}".format(handler.__module__, handler.__qualname__)
+
+
+class ResponseCache:
+    """A bounded LRU of handler responses by their validated arguments, each kept for ttl seconds."""
+
+    def __init__(self, name, ttl, size=CACHE_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        CACHES[name] = self
+
+    @staticmethod
+    def key(kwargs):
+        """The cache key of validated arguments, user_pubkey included when authenticated."""
+        return tuple(sorted((key, str(value)) for key, value in kwargs.items()))
+
+    def get(self, kwargs):
+        """The cached response for kwargs, None if there is none."""
+        key = self.key(kwargs)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+        CACHE_REQUESTS.inc(self.name, 'miss' if entry is None else 'hit')
+        return None if entry is None else entry[1]
+
+    def put(self, kwargs, response):
+        """Cache a successful response, evicting the least recently used one if full."""
+        if 'error' in response or response.get('status', 200) != 200:
+            return
+        key = self.key(kwargs)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, **kwargs):
+        """Drop the responses to calls with all the given arguments, or all responses if none are given."""
+        items = set((key, str(value)) for key, value in kwargs.items())
+        with self.lock:
+            for key in [key for key in self.entries if items.issubset(key)]:
+                del self.entries[key]
+
+
+def invalidate(name=None, **kwargs):
+    """
+    Drop the cached responses of a handler, by its cache_name, or of all handlers, to calls with all the given
+    arguments. The cache attribute of a cached view does the same for its handler.
+    """
+    for cache in [CACHES[name]] if name else list(CACHES.values()):
+        cache.invalidate(**kwargs)
+
+
+def add_headers(response, cache, private, request):
+    """Make a response to a cached call conditional, and cacheable by clients for the cache's ttl."""
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.max_age = int(cache.ttl)
+    return response.make_conditional(request)
@@ -0,0 +1,129 @@
+"""Response compression negotiated from Accept-Encoding, as WSGI middleware."""
+import os
+import zlib
+
+import werkzeug.http
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # pylint: disable=invalid-name
+
+# Set to 0 to not compress responses.
+COMPRESS = os.environ.get('PAKET_COMPRESS', '1') != '0'
+# Responses known to be smaller than this many bytes are not worth compressing.
+COMPRESS_MIN_SIZE = int(os.environ.get('PAKET_COMPRESS_MIN_SIZE', 1024))
+COMPRESS_TYPES = frozenset(os.environ.get(
+    'PAKET_COMPRESS_TYPES',
+    'application/json,application/javascript,image/svg+xml,text/css,text/html,text/javascript,text/plain').split(','))
+COMPRESS_LEVEL = int(os.environ.get('PAKET_COMPRESS_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('PAKET_BROTLI_QUALITY', 4))
+# Preferred first.
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+class Compressor:
+    """A streaming compressor for an encoding."""
+
+    def __init__(self, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.compress, self.finish = compressor.compress, compressor.flush
+
+
+class CompressedIterable:
+    """Compress the chunks of a response body as they are produced, closing the original body when closed."""
+
+    def __init__(self, app_iter, compressor):
+        self.app_iter = app_iter
+        self.compressor = compressor
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            chunk = self.compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        yield self.compressor.finish()
+
+    def close(self):
+        """Close the original body, as WSGI requires."""
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+class CompressionMiddleware:
+    """
+    Compress successful responses of allowed content types, unless already encoded or known to be small.
+    Bodies are compressed while streamed, never buffered whole.
+    """
+
+    def __init__(self, app, min_size=COMPRESS_MIN_SIZE, types=COMPRESS_TYPES):
+        self.app = app
+        self.min_size = min_size
+        self.types = types
+
+    @staticmethod
+    def choose_encoding(environ):
+        """The preferred encoding the client accepts, None if there is none."""
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not environ.get('HTTP_ACCEPT_ENCODING'):
+            return None
+        accepted = werkzeug.http.parse_accept_header(environ['HTTP_ACCEPT_ENCODING'])
+        for encoding in ENCODINGS:
+            if accepted.quality(encoding) > 0:
+                return encoding
+        return None
+
+    def should_compress(self, status, headers):
+        """Is a response with this status and headers worth compressing."""
+        headers = {key.lower(): value for key, value in headers}
+        return (
+            status.startswith('200') and 'content-encoding' not in headers and
+            'no-transform' not in headers.get('cache-control', '') and
+            headers.get('content-type', '').split(';')[0].strip().lower() in self.types and
+            int(headers.get('content-length') or self.min_size) >= self.min_size)
+
+    @staticmethod
+    def compressed_headers(headers, encoding):
+        """Headers of the compressed response, its length unknown and its ETag weakened."""
+        compressed_headers = []
+        vary = 'Accept-Encoding'
+        for key, value in headers:
+            lowered_key = key.lower()
+            if lowered_key == 'content-length':
+                continue
+            if lowered_key == 'vary':
+                vary = "{}, {}".format(value, vary)
+                continue
+            if lowered_key == 'etag' and not value.startswith('W/'):
+                value = 'W/' + value
+            compressed_headers.append((key, value))
+        compressed_headers.extend([('Content-Encoding', encoding), ('Vary', vary)])
+        return compressed_headers
+
+    def __call__(self, environ, start_response):
+        encoding = self.choose_encoding(environ)
+        if encoding is None:
+            return self.app(environ, start_response)
+        compressors = []
+        returned = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            """Switch to compressed headers if the response is worth compressing."""
+            # Responses started only once their body is iterated are left alone.
+            if returned or not self.should_compress(status, headers):
+                # An error response may replace a compressed one that has not started.
+                del compressors[:]
+                return start_response(status, headers, exc_info)
+            compressor = Compressor(encoding)
+            compressors.append(compressor)
+            write = start_response(status, self.compressed_headers(headers, encoding), exc_info)
+            return lambda data: write(compressor.compress(data))
+
+        app_iter = self.app(environ, compressing_start_response)
+        returned.append(True)
+        if not compressors:
+            return app_iter
+        return CompressedIterable(app_iter, compressors[-1])
@@ -0,0 +1,155 @@
+"""
+Drive signed traffic at a PAKET endpoint and report throughput and latency.
+Example: python -m webserver.loadgen http://localhost:5000/v1/check_signature --concurrency 32 --requests 10000
+"""
+import argparse
+import collections
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import stellar_base.keypair
+
+import webserver.validation
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class PreparedRequest:
+    """A request with everything signed ahead of time."""
+
+    def __init__(self, url, method, data, headers):
+        self.url = url
+        self.method = method
+        self.data = data
+        self.headers = headers
+
+
+def prepare_requests(url, method='GET', kwargs=None, workers=1, count=1, sign=True, compact=False):
+    """
+    Prepare count requests split between workers, each worker with its own keypair.
+    A worker sends its requests in order, so its nonces reach the server strictly increasing.
+    """
+    kwargs = kwargs or {}
+    encoded_kwargs = urllib.parse.urlencode(kwargs)
+    if method == 'GET' and kwargs:
+        # The server checks fingerprints against the full url, query string included.
+        url, data = "{}?{}".format(url, encoded_kwargs), None
+    else:
+        data = encoded_kwargs.encode()
+    first_nonce = int(time.time() * 1000)
+    plans = []
+    for worker in range(workers):
+        keypair = stellar_base.keypair.Keypair.random()
+        pubkey, seed = keypair.address().decode(), keypair.seed().decode()
+        plan = []
+        share = count // workers + (worker < count % workers)
+        for nonce in range(first_nonce, first_nonce + share):
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if data is not None else {}
+            if sign:
+                fingerprint = webserver.validation.generate_fingerprint(url, kwargs, compact, nonce)
+                headers.update({
+                    'Pubkey': pubkey, 'Fingerprint': fingerprint,
+                    'Signature': webserver.validation.sign_fingerprint(fingerprint, seed)})
+            plan.append(PreparedRequest(url, method, data, headers))
+        plans.append(plan)
+    return plans
+
+
+def send(prepared_request, timeout=30):
+    """Send a request, returning its outcome: 'ok', an internal error code, an HTTP status or an exception name."""
+    request = urllib.request.Request(
+        prepared_request.url, prepared_request.data, prepared_request.headers, method=prepared_request.method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        return 'ok'
+    except urllib.error.HTTPError as exception:
+        try:
+            error = json.loads(exception.read().decode()).get('error')
+            return "internal_error_code {}".format(error['internal_error_code'])
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return "http {}".format(exception.code)
+    except (urllib.error.URLError, OSError) as exception:
+        return type(exception).__name__
+
+
+def run(plans, rate=None, timeout=30):
+    """
+    Send the prepared requests, a thread per plan, returning (latency, outcome) pairs and the elapsed seconds.
+    Without a rate every thread sends as fast as it can. With a rate, requests are scheduled at that many
+    per second overall, and latency counts from the scheduled time, so a slow server can not hide its queueing.
+    """
+    results = []
+    results_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def work(worker, plan):
+        """Send a plan's requests in order."""
+        worker_results = []
+        for index, prepared_request in enumerate(plan):
+            request_start = time.perf_counter()
+            if rate:
+                scheduled = start + (index * len(plans) + worker) / rate
+                if scheduled > request_start:
+                    time.sleep(scheduled - request_start)
+                request_start = scheduled
+            outcome = send(prepared_request, timeout)
+            worker_results.append((time.perf_counter() - request_start, outcome))
+        with results_lock:
+            results.extend(worker_results)
+
+    threads = [threading.Thread(target=work, args=(worker, plan)) for worker, plan in enumerate(plans)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def percentile(sorted_values, percent):
+    """Nearest rank percentile of sorted values."""
+    if not sorted_values:
+        return None
+    rank = max(int(-(-percent * len(sorted_values) // 100)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def report(results, elapsed):
+    """A human readable report of the results."""
+    latencies = sorted(latency for latency, _ in results)
+    outcomes = collections.Counter(outcome for _, outcome in results)
+    lines = ["{} requests in {:.2f} seconds, {:.1f} per second".format(
+        len(results), elapsed, len(results) / elapsed if elapsed else 0)]
+    if latencies:
+        lines.append(', '.join("p{:g} {:.1f}ms".format(percent, percentile(latencies, percent) * 1000)
+                               for percent in PERCENTILES))
+    for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1]):
+        lines.append("{:>8} {}".format(count, outcome))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    """Parse arguments, prepare the requests, drive them and print a report."""
+    parser = argparse.ArgumentParser(prog='python -m webserver.loadgen', description=__doc__.split('\n')[1])
+    parser.add_argument('url', help='full url of the endpoint')
+    parser.add_argument('--method', default='GET', choices=['GET', 'POST'])
+    parser.add_argument('--data', action='append', default=[], metavar='KEY=VALUE', help='call argument, repeatable')
+    parser.add_argument('--concurrency', type=int, default=8, help='sending threads, each with its own keypair')
+    parser.add_argument('--requests', type=int, default=1000, help='total requests')
+    parser.add_argument('--rate', type=float, help='requests per second, open loop, instead of as fast as possible')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for each response')
+    parser.add_argument('--unsigned', action='store_true', help='send no authentication headers')
+    parser.add_argument('--compact', action='store_true', help='use the compact fingerprint format')
+    args = parser.parse_args(args)
+    kwargs = dict(item.split('=', 1) for item in args.data)
+    plans = prepare_requests(
+        args.url, args.method, kwargs, args.concurrency, args.requests, not args.unsigned, args.compact)
+    print(report(*run(plans, args.rate, args.timeout)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Non blocking, deduplicated logging for the request path."""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+import webserver.metrics
+
+# Set to 0 to have setup leave logging synchronous.
+ASYNC_LOGGING = os.environ.get('PAKET_ASYNC_LOGGING', '1') != '0'
+# Records waiting to be emitted, beyond which new records are dropped and counted.
+LOG_QUEUE_SIZE = int(os.environ.get('PAKET_LOG_QUEUE_SIZE', 10000))
+# Seconds during which repeats of a record are suppressed, and then summarized.
+LOG_DEDUP_INTERVAL = float(os.environ.get('PAKET_LOG_DEDUP_INTERVAL', 10))
+# Seconds between checks for ended windows to summarize, whether records arrive or not.
+LOG_SWEEP_INTERVAL = 1
+ASYNC_LOGGERS = ('pkt.web', 'pkt.api.validation')
+LOG_RECORDS_DROPPED = webserver.metrics.REGISTRY.counter(
+    'paket_log_records_dropped_total', 'Log records dropped because the log queue was full.')
+LOG_RECORDS_SUPPRESSED = webserver.metrics.REGISTRY.counter(
+    'paket_log_records_suppressed_total', 'Log records suppressed as repeats.')
+
+
+class KeyValues:
+    """Fields of a structured log message, only rendered as key=value pairs if the record is emitted."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    @staticmethod
+    def quote(value):
+        """Quote values that would not read back as a single value."""
+        value = str(value)
+        if not value or any(character in value for character in ' "=\n'):
+            return json.dumps(value)
+        return value
+
+    def __str__(self):
+        return ' '.join("{}={}".format(key, self.quote(value)) for key, value in self.fields.items())
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on a bounded queue without ever blocking, counting the records it has to drop."""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The queue is in process, so formatting is left to the listener thread.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+class DeduplicatingHandler(logging.Handler):
+    """
+    Passes records on to handlers, suppressing repeats of a record for an interval
+    and then emitting a summary of how many were suppressed.
+    """
+
+    def __init__(self, handlers, interval=LOG_DEDUP_INTERVAL, queue_handler=None):
+        super().__init__()
+        self.handlers = handlers
+        self.interval = interval
+        self.queue_handler = queue_handler
+        self.reported_dropped = 0
+        # Key to [window start, suppressed count, first record].
+        self.windows = {}
+        self.last_sweep = time.monotonic()
+
+    @staticmethod
+    def key(record):
+        """What makes records repeats of each other."""
+        return record.name, record.levelno, record.getMessage(), record.exc_info[0] if record.exc_info else None
+
+    def forward(self, record):
+        """Pass a record on to the handlers whose level it reaches."""
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def summarize(self, record, message, *args):
+        """Forward a summary record, with the name and level of record."""
+        self.forward(logging.LogRecord(
+            record.name, record.levelno, record.pathname, record.lineno, message, args, None))
+
+    def sweep(self, now, force=False):
+        """Summarize the windows that ended, and report dropped records."""
+        self.last_sweep = now
+        for key, (start, suppressed, record) in list(self.windows.items()):
+            if force or now - start >= self.interval:
+                del self.windows[key]
+                if suppressed:
+                    self.summarize(record, "%s repeats suppressed in %.0f seconds of: %s",
+                                   suppressed, now - start, record.getMessage())
+        if self.queue_handler is not None and self.queue_handler.dropped != self.reported_dropped:
+            dropped = self.queue_handler.dropped - self.reported_dropped
+            self.reported_dropped += dropped
+            self.forward(logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0, "%s log records dropped, the log queue was full", (dropped,),
+                None))
+
+    def emit(self, record):
+        try:
+            now = time.monotonic()
+            if now - self.last_sweep >= 1:
+                self.sweep(now)
+            key = self.key(record)
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is not None and window[1]:
+                    self.summarize(window[2], "%s repeats suppressed in %.0f seconds of: %s",
+                                   window[1], now - window[0], window[2].getMessage())
+                self.windows[key] = [now, 0, record]
+                self.forward(record)
+            else:
+                window[1] += 1
+                LOG_RECORDS_SUPPRESSED.inc()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def tick(self):
+        """Summarize the windows that ended, for when no record arrives to do it."""
+        with self.lock:
+            self.sweep(time.monotonic())
+
+    def flush(self):
+        """Summarize all pending windows."""
+        with self.lock:
+            self.sweep(time.monotonic(), True)
+
+
+class TickingQueueListener(logging.handlers.QueueListener):
+    """Passes queued records on to a deduplicating handler, ticking it whenever the queue stays empty a while."""
+
+    def __init__(self, record_queue, handler, tick_interval=LOG_SWEEP_INTERVAL):
+        super().__init__(record_queue, handler)
+        self.tick_interval = tick_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.tick_interval)
+            except queue.Empty:
+                self.handlers[0].tick()
+
+
+class AsyncLogging:
+    """
+    Moves the handlers reached by some loggers behind a queue, emptied by a listener thread,
+    so logging on the request path never waits for I/O.
+    """
+
+    def __init__(self, logger_names=ASYNC_LOGGERS, queue_size=LOG_QUEUE_SIZE, interval=LOG_DEDUP_INTERVAL,
+                 sweep_interval=LOG_SWEEP_INTERVAL):
+        self.loggers = [logging.getLogger(name) for name in logger_names]
+        self.queue_size = queue_size
+        self.sweep_interval = sweep_interval
+        handlers = []
+        for logger in self.loggers:
+            current = logger
+            while current is not None:
+                handlers.extend(handler for handler in current.handlers if handler not in handlers)
+                current = current.parent if current.propagate else None
+        if not handlers and logging.lastResort is not None:
+            handlers.append(logging.lastResort)
+        self.queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.deduplicating_handler = DeduplicatingHandler(handlers, interval, self.queue_handler)
+        for logger in self.loggers:
+            logger.handlers = [self.queue_handler]
+            logger.propagate = False
+        self.listener = None
+        self.start()
+        atexit.register(self.stop)
+
+    def start(self):
+        """Start a listener thread."""
+        self.listener = TickingQueueListener(
+            self.queue_handler.queue, self.deduplicating_handler, self.sweep_interval)
+        self.listener.start()
+
+    def stop(self):
+        """Emit everything queued and stop the listener thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.deduplicating_handler.flush()
+
+    def after_fork(self):
+        """Start over in a forked child, where the listener thread did not survive."""
+        self.queue_handler.queue = queue.Queue(self.queue_size)
+        self.deduplicating_handler.createLock()
+        self.start()
+
+
+# Installed by install, usually through webserver.setup.
+ASYNC = None
+ASYNC_LOCK = threading.Lock()
+
+
+def install(logger_names=ASYNC_LOGGERS, queue_size=LOG_QUEUE_SIZE, interval=LOG_DEDUP_INTERVAL):
+    """Make the loggers asynchronous, once."""
+    global ASYNC  # pylint: disable=global-statement
+    with ASYNC_LOCK:
+        if ASYNC is None:
+            ASYNC = AsyncLogging(logger_names, queue_size, interval)
+    return ASYNC
+
+
+def after_fork():
+    """Restart asynchronous logging in a forked child, if it was installed."""
+    if ASYNC is not None:
+        ASYNC.after_fork()
@@ -0,0 +1,151 @@
+"""Metrics, exported in the Prometheus text format."""
+import bisect
+import hmac
+import os
+import threading
+
+# Route of the metrics endpoint registered by webserver.setup, e.g. /metrics. Not registered unless set.
+METRICS_ROUTE = os.environ.get('PAKET_METRICS_ROUTE', '')
+# If set, scrapers must send it as a bearer token.
+METRICS_TOKEN = os.environ.get('PAKET_METRICS_TOKEN', '')
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def authorized(authorization):
+    """Does an Authorization header value allow scraping."""
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest((authorization or '').encode(), "Bearer {}".format(METRICS_TOKEN).encode())
+
+
+def format_labels(names, values, extra=''):
+    """Format label names and values as {name="value",...}."""
+    labels = ["{}=\"{}\"".format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{{{}}}".format(','.join(labels)) if labels else ''
+
+
+class Metric:
+    """A metric with a value per combination of labels."""
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render(self):
+        """The metric's lines in the text format."""
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.metric_type)]
+        for labels, value in sorted(self.snapshot().items()):
+            lines.extend(self.render_value(labels, value))
+        return lines
+
+    def snapshot(self):
+        """A consistent copy of the values."""
+        with self.lock:
+            return dict(self.values)
+
+    def render_value(self, labels, value):
+        """The lines of a single label combination."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+    metric_type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """Increment the counter of labels."""
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render_value(self, labels, value):
+        return ["{}{} {}".format(self.name, format_labels(self.label_names, labels), value)]
+
+
+class Histogram(Metric):
+    """Counts of observations by buckets of value, with their sum."""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """Record an observation of labels."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            try:
+                counts, total = self.values[labels]
+            except KeyError:
+                counts, total = [0] * (len(self.buckets) + 1), 0
+            counts[index] += 1
+            self.values[labels] = counts, total + value
+
+    def snapshot(self):
+        # Copy the counts too, observations update them in place.
+        with self.lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self.values.items()}
+
+    def render_value(self, labels, value):
+        counts, total = value
+        lines = []
+        cumulative_count = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative_count += count
+            le_label = "le=\"{}\"".format('+Inf' if bound == float('inf') else repr(float(bound)))
+            lines.append("{}_bucket{} {}".format(
+                self.name, format_labels(self.label_names, labels, le_label), cumulative_count))
+        lines.append("{}_sum{} {}".format(self.name, format_labels(self.label_names, labels), total))
+        lines.append("{}_count{} {}".format(self.name, format_labels(self.label_names, labels), cumulative_count))
+        return lines
+
+
+class Registry:
+    """A collection of metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, label_names=()):
+        """Register a counter."""
+        self.metrics.append(Counter(name, documentation, label_names))
+        return self.metrics[-1]
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        """Register a histogram."""
+        self.metrics.append(Histogram(name, documentation, label_names, buckets))
+        return self.metrics[-1]
+
+    def render(self):
+        """All metrics in the text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CALL_STAGE_SECONDS = REGISTRY.histogram(
+    'paket_call_stage_seconds', 'Time spent in each stage of API calls.', ['endpoint', 'stage'])
+CALL_RESPONSES = REGISTRY.counter(
+    'paket_call_responses_total', 'API call responses.', ['endpoint', 'status', 'internal_error_code'])
+RATE_LIMITED = REGISTRY.counter('paket_rate_limited_total', 'Requests rejected by the rate limiter.')
+STATIC_REQUESTS = REGISTRY.counter('paket_static_requests_total', 'Static file requests.', ['result'])
+
+
+def observe_call(endpoint, stages, response):
+    """Record the stage durations and the response of an API call."""
+    for stage, duration in stages.items():
+        CALL_STAGE_SECONDS.observe(duration, endpoint, stage)
+    error = response.get('error')
+    internal_error_code = error.get('internal_error_code', '') if isinstance(error, dict) else ''
+    CALL_RESPONSES.inc(endpoint, response.get('status', 200), internal_error_code)
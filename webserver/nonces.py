@@ -0,0 +1,377 @@
+"""Nonce stores for fingerprint replay protection."""
+import atexit
+import bisect
+import contextlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+import pymysql
+
+LOGGER = logging.getLogger('pkt.api.nonces')
+NONCE_STORE = os.environ.get('PAKET_NONCE_STORE', 'mysql')
+MEMORY_STRIPES = int(os.environ.get('PAKET_NONCE_MEMORY_STRIPES', 64))
+SQLITE_PATH = os.environ.get('PAKET_NONCE_SQLITE_PATH', 'nonces.db')
+DB_HOST = os.environ.get('PAKET_DB_HOST', '127.0.0.1')
+DB_PORT = int(os.environ.get('PAKET_DB_PORT', 3306))
+DB_USER = os.environ.get('PAKET_DB_USER', 'root')
+DB_PASSWORD = os.environ.get('PAKET_DB_PASSWORD')
+DB_NAME = os.environ.get('PAKET_DB_NAME', 'paket')
+DB_POOL_SIZE = int(os.environ.get('PAKET_DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('PAKET_DB_POOL_TIMEOUT', 5))
+DB_POOL_RECYCLE = float(os.environ.get('PAKET_DB_POOL_RECYCLE', 60))
+# Replay window store: milliseconds nonces may be off the server clock either way, recent nonces remembered
+# per pubkey, seconds between flushes of the high water marks, and the store they are flushed to.
+NONCE_WINDOW = int(os.environ.get('PAKET_NONCE_WINDOW', 5 * 60 * 1000))
+NONCE_RECENT = int(os.environ.get('PAKET_NONCE_RECENT', 64))
+NONCE_FLUSH_INTERVAL = float(os.environ.get('PAKET_NONCE_FLUSH_INTERVAL', 1))
+NONCE_BACKING_STORE = os.environ.get('PAKET_NONCE_BACKING_STORE', 'mysql')
+
+
+def pubkey_text(pubkey):
+    """A pubkey as text, stellar_base gives addresses as bytes."""
+    return pubkey.decode() if isinstance(pubkey, bytes) else pubkey
+
+
+class NonceStore:
+    """Interface of a store keeping the highest nonce seen for every pubkey."""
+
+    def init_db(self):
+        """Create whatever the store needs to operate."""
+
+    def advance(self, pubkey, nonce, user_name=None):
+        """
+        Atomically set the pubkey's nonce (creating it if needed) if it is bigger than the stored one.
+        Return True if the nonce advanced, False otherwise.
+        """
+        raise NotImplementedError
+
+    def get(self, pubkey):
+        """The pubkey's nonce, None if it has none."""
+        raise NotImplementedError
+
+    def advance_many(self, nonces):
+        """Advance the nonces of many (pubkey, nonce, user_name) tuples, ignoring those that would not advance."""
+        for pubkey, nonce, user_name in nonces:
+            self.advance(pubkey, nonce, user_name)
+
+
+class MemoryNonceStore(NonceStore):
+    """A process local store, striped over several locks to reduce contention."""
+
+    def __init__(self, stripes=MEMORY_STRIPES):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.stripes = [{} for _ in range(stripes)]
+        self.user_names = {}
+
+    def advance(self, pubkey, nonce, user_name=None):
+        """Advance the nonce under the lock of the pubkey's stripe."""
+        pubkey = pubkey_text(pubkey)
+        index = zlib.crc32(pubkey.encode()) % len(self.stripes)
+        with self.locks[index]:
+            nonces = self.stripes[index]
+            if pubkey in nonces and nonce <= nonces[pubkey]:
+                return False
+            nonces[pubkey] = nonce
+            if user_name:
+                self.user_names[pubkey] = user_name
+        return True
+
+    def get(self, pubkey):
+        """Get the nonce from the pubkey's stripe."""
+        pubkey = pubkey_text(pubkey)
+        index = zlib.crc32(pubkey.encode()) % len(self.stripes)
+        with self.locks[index]:
+            return self.stripes[index].get(pubkey)
+
+
+class SQLiteNonceStore(NonceStore):
+    """A single node store in an SQLite database in WAL mode."""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        """A connection for the current thread."""
+        try:
+            return self.local.connection
+        except AttributeError:
+            connection = sqlite3.connect(self.path, timeout=DB_POOL_TIMEOUT, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            return connection
+
+    def init_db(self):
+        """Create the nonces table."""
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS nonces(
+                pubkey VARCHAR(56) PRIMARY KEY,
+                user_name VARCHAR(32) UNIQUE,
+                nonce BIGINT NOT NULL DEFAULT 0)''')
+        LOGGER.debug('nonces table ready in %s', self.path)
+
+    def advance(self, pubkey, nonce, user_name=None):
+        """Advance the nonce with a conditional upsert."""
+        cursor = self.connection.execute('''
+            INSERT INTO nonces (pubkey, nonce, user_name) VALUES (?, ?, ?)
+            ON CONFLICT(pubkey) DO UPDATE SET
+                nonce = excluded.nonce, user_name = COALESCE(excluded.user_name, user_name)
+            WHERE excluded.nonce > nonces.nonce''', (pubkey, nonce, user_name or None))
+        return cursor.rowcount > 0
+
+    def get(self, pubkey):
+        """Select the nonce."""
+        row = self.connection.execute('SELECT nonce FROM nonces WHERE pubkey = ?', (pubkey,)).fetchone()
+        return None if row is None else row[0]
+
+    def advance_many(self, nonces):
+        """Advance the nonces in a single transaction."""
+        with self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.executemany('''
+                INSERT INTO nonces (pubkey, nonce, user_name) VALUES (?, ?, ?)
+                ON CONFLICT(pubkey) DO UPDATE SET
+                    nonce = excluded.nonce, user_name = COALESCE(excluded.user_name, user_name)
+                WHERE excluded.nonce > nonces.nonce''', [
+                    (pubkey, nonce, user_name or None) for pubkey, nonce, user_name in nonces])
+
+
+class ConnectionPool:
+    """A bounded pool of reusable SQL connections."""
+
+    def __init__(self, size, timeout, recycle, **connection_kwargs):
+        self.timeout = timeout
+        self.recycle = recycle
+        self.connection_kwargs = connection_kwargs
+        self.connections = queue.LifoQueue(size)
+        # Slots are filled with None and connected lazily, so an idle pool holds no connections.
+        for _ in range(size):
+            self.connections.put((None, 0))
+
+    def connect(self):
+        """Open a new connection."""
+        return pymysql.connect(cursorclass=pymysql.cursors.DictCursor, **self.connection_kwargs)
+
+    @contextlib.contextmanager
+    def __call__(self):
+        """Lend a cursor, commit on success and return the connection to the pool."""
+        try:
+            connection, last_used = self.connections.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("no free SQL connection after {} seconds".format(self.timeout))
+        try:
+            if connection is None:
+                connection = self.connect()
+            elif time.monotonic() - last_used > self.recycle:
+                # Only connections that sat idle long enough to be dropped by the server pay for a ping.
+                connection.ping(reconnect=True)
+            with connection.cursor() as cursor:
+                yield cursor
+            connection.commit()
+        except pymysql.err.Error:
+            # A connection in an unknown state is discarded rather than reused.
+            if connection is not None:
+                with contextlib.suppress(Exception):
+                    connection.close()
+                connection = None
+            raise
+        except Exception:
+            if connection is not None:
+                connection.rollback()
+            raise
+        finally:
+            self.connections.put((connection, time.monotonic()))
+
+
+class MySQLNonceStore(NonceStore):
+    """The shared store in the MySQL nonces table."""
+
+    def __init__(
+            self, host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, db_name=DB_NAME,
+            pool_size=DB_POOL_SIZE, pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE):
+        self.db_name = db_name
+        self.sql_connection = ConnectionPool(
+            pool_size, pool_timeout, pool_recycle, host=host, port=port, user=user, password=password, db=db_name)
+
+    def init_db(self):
+        """Create the nonces table."""
+        with self.sql_connection() as sql:
+            # Not using IF EXISTS here in case we want different handling.
+            sql.execute("""
+                SELECT 1 FROM information_schema.tables
+                WHERE table_schema = %s
+                AND table_name = 'nonces'""", (self.db_name,))
+            if len(sql.fetchall()) == 1:
+                LOGGER.debug('nonces table already exists')
+                return
+            sql.execute('''
+                CREATE TABLE nonces(
+                    pubkey VARCHAR(56) PRIMARY KEY,
+                    user_name VARCHAR(32) UNIQUE,
+                    nonce BIGINT NOT NULL DEFAULT 0)''')
+            LOGGER.debug('nonces table created')
+
+    def advance(self, pubkey, nonce, user_name=None):
+        """Advance the nonce with a conditional upsert in a single round trip."""
+        with self.sql_connection() as sql:
+            # MySQL evaluates assignments left to right, so user_name must be set before nonce changes.
+            # Without CLIENT.FOUND_ROWS, affected rows are 1 for an insert, 2 for an update and 0 if nothing changed.
+            sql.execute("""
+                INSERT INTO nonces (pubkey, nonce, user_name) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    user_name = IF(VALUES(nonce) > nonce, COALESCE(VALUES(user_name), user_name), user_name),
+                    nonce = IF(VALUES(nonce) > nonce, VALUES(nonce), nonce)""", (pubkey, nonce, user_name or None))
+            return sql.rowcount > 0
+
+    def get(self, pubkey):
+        """Select the nonce."""
+        with self.sql_connection() as sql:
+            sql.execute("SELECT nonce FROM nonces WHERE pubkey = %s", (pubkey,))
+            row = sql.fetchone()
+            return None if row is None else row['nonce']
+
+    def advance_many(self, nonces):
+        """Advance the nonces in a single transaction."""
+        with self.sql_connection() as sql:
+            sql.executemany("""
+                INSERT INTO nonces (pubkey, nonce, user_name) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    user_name = IF(VALUES(nonce) > nonce, COALESCE(VALUES(user_name), user_name), user_name),
+                    nonce = IF(VALUES(nonce) > nonce, VALUES(nonce), nonce)""", [
+                        (pubkey, nonce, user_name or None) for pubkey, nonce, user_name in nonces])
+
+
+class ReplayWindowNonceStore(NonceStore):
+    """
+    Accepts nonces, which must be millisecond timestamps, inside a window around the current time, in any order,
+    as long as the pubkey did not use them yet. The recent nonces of every pubkey are kept in memory, and the highest
+    ones are flushed to a backing store in batches, off the request path.
+    Nonces are never accepted below the time the store started or the pubkey's nonce in the backing store,
+    so replays stay refused after a restart. Only nonces ahead of the clock, accepted within a flush interval
+    before a crash, escape this.
+    The window lives in the process: with several hosts, route every pubkey to a single one,
+    and do not use it with several pre-forked workers (webserver.prefork refuses to).
+    """
+
+    def __init__(
+            self, backing_store=None, window=NONCE_WINDOW, recent=NONCE_RECENT,
+            flush_interval=NONCE_FLUSH_INTERVAL, stripes=MEMORY_STRIPES):
+        self.backing_store = backing_store or from_config(NONCE_BACKING_STORE)
+        self.window = window
+        self.recent = recent
+        self.floor = int(time.time() * 1000)
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        # Every pubkey has a floor and a sorted list of its recent nonces.
+        self.stripes = [{} for _ in range(stripes)]
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.flush_interval = flush_interval
+        # Forked children inherit the pending nonces, and the backing store connections, of their parent.
+        self.pid = os.getpid()
+        threading.Thread(target=self.flush_forever, daemon=True).start()
+        atexit.register(self.flush)
+
+    def init_db(self):
+        """Initialize the backing store."""
+        self.backing_store.init_db()
+
+    def advance(self, pubkey, nonce, user_name=None):
+        """Accept a nonce inside the window that is above the pubkey's floor and not used yet."""
+        now = int(time.time() * 1000)
+        if abs(nonce - now) > self.window:
+            return False
+        pubkey = pubkey_text(pubkey)
+        index = zlib.crc32(pubkey.encode()) % len(self.stripes)
+        stored_nonce = None
+        # Nonces accepted before a restart were at most a window ahead of the clock, so after two windows
+        # they are out of the window anyway, and unknown pubkeys need not be looked up.
+        if pubkey not in self.stripes[index] and now < self.floor + 2 * self.window:
+            stored_nonce = self.backing_store.get(pubkey)
+        with self.locks[index]:
+            if pubkey not in self.stripes[index]:
+                self.stripes[index][pubkey] = (max(self.floor, stored_nonce or 0), [])
+            floor, nonces = self.stripes[index][pubkey]
+            position = bisect.bisect_left(nonces, nonce)
+            if nonce <= floor or (position < len(nonces) and nonces[position] == nonce):
+                return False
+            # Once the list is full, nonces below all the remembered ones can not be told apart from replays.
+            if len(nonces) >= self.recent:
+                if position == 0:
+                    return False
+                self.stripes[index][pubkey] = (nonces.pop(0), nonces)
+                position -= 1
+            nonces.insert(position, nonce)
+            highest = nonces[-1]
+        with self.pending_lock:
+            pending_nonce, pending_user_name = self.pending.get(pubkey, (0, None))
+            self.pending[pubkey] = (max(pending_nonce, highest), user_name or pending_user_name)
+        return True
+
+    def get(self, pubkey):
+        """The highest nonce accepted, or stored, for the pubkey."""
+        pubkey = pubkey_text(pubkey)
+        index = zlib.crc32(pubkey.encode()) % len(self.stripes)
+        with self.locks[index]:
+            if pubkey in self.stripes[index]:
+                floor, nonces = self.stripes[index][pubkey]
+                return nonces[-1] if nonces else floor
+        return self.backing_store.get(pubkey)
+
+    def flush(self):
+        """Write the pending high water marks to the backing store in one batch, from the process that owns them."""
+        if os.getpid() != self.pid:
+            return
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            self.backing_store.advance_many(
+                (pubkey, nonce, user_name) for pubkey, (nonce, user_name) in pending.items())
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("can not flush %s nonces, will retry", len(pending))
+            with self.pending_lock:
+                for pubkey, (nonce, user_name) in pending.items():
+                    pending_nonce, pending_user_name = self.pending.get(pubkey, (0, None))
+                    self.pending[pubkey] = (max(nonce, pending_nonce), pending_user_name or user_name)
+
+    def forget_idle(self):
+        """Forget pubkeys whose nonces all left the window and were flushed, the backing store has their floor."""
+        oldest = int(time.time() * 1000) - self.window
+        for lock, pubkeys in zip(self.locks, self.stripes):
+            with lock, self.pending_lock:
+                for pubkey in [pubkey for pubkey, (floor, nonces) in pubkeys.items()
+                               if (nonces[-1] if nonces else floor) < oldest and pubkey not in self.pending]:
+                    del pubkeys[pubkey]
+
+    def flush_forever(self):
+        """Flush pending nonces and forget idle pubkeys every flush interval."""
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            self.forget_idle()
+
+
+NONCE_STORES = {
+    'memory': MemoryNonceStore,
+    'sqlite': SQLiteNonceStore,
+    'mysql': MySQLNonceStore,
+    'window': ReplayWindowNonceStore}
+
+
+def from_config(name=None):
+    """Create the nonce store named by name, or by the PAKET_NONCE_STORE environment variable."""
+    name = name or NONCE_STORE
+    try:
+        store_class = NONCE_STORES[name]
+    except KeyError:
+        raise ValueError("unknown nonce store {}, choose one of: {}".format(name, ', '.join(NONCE_STORES)))
+    LOGGER.debug('using %s nonce store', name)
+    return store_class()
@@ -0,0 +1,88 @@
+"""OpenAPI spec serving, rendered once and kept compressed."""
+import gzip
+import hashlib
+import logging
+import os
+import threading
+
+import flask
+
+LOGGER = logging.getLogger('pkt.web.openapi')
+# Render the specs when the app is set up, instead of on their first request.
+OPENAPI_PRECOMPUTE = bool(os.environ.get('PAKET_OPENAPI_PRECOMPUTE'))
+OPENAPI_MAX_AGE = int(os.environ.get('PAKET_OPENAPI_MAX_AGE', 300))
+COMPRESS_LEVEL = 9
+
+
+class CachedSpec:
+    """The output of a flasgger spec view, rendered on first use."""
+
+    def __init__(self, view, route):
+        self.view = view
+        self.route = route
+        self.lock = threading.Lock()
+        self.body = self.gzipped = self.etag = self.gzipped_etag = None
+
+    def render(self):
+        """Render the spec, if not rendered yet. Needs a request context."""
+        if self.body is None:
+            with self.lock:
+                if self.body is None:
+                    body = self.view().get_data()
+                    self.gzipped = gzip.compress(body, COMPRESS_LEVEL)
+                    self.etag = hashlib.sha256(body).hexdigest()
+                    # Every content coding is a representation of its own, with its own strong validator.
+                    self.gzipped_etag = "{}-gzip".format(self.etag)
+                    self.body = body
+        return self.body
+
+    def response(self):
+        """A response serving the spec to the current request."""
+        self.render()
+        response_class = flask.current_app.response_class
+        gzipped = bool(flask.request.accept_encodings['gzip'])
+        etag = self.gzipped_etag if gzipped else self.etag
+        if flask.request.if_none_match.contains_weak(etag):
+            response = response_class(status=304)
+        elif gzipped:
+            response = response_class(self.gzipped, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = response_class(self.body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = OPENAPI_MAX_AGE
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+def install(app, swagger):
+    """Replace the spec views of a flasgger.Swagger with cached ones, returning the cached specs."""
+    cached_specs = []
+    for spec in swagger.config['specs']:
+        endpoint = "{}.{}".format(swagger.config.get('endpoint', 'flasgger'), spec['endpoint'])
+        cached_spec = CachedSpec(app.view_functions[endpoint], spec['route'])
+        app.view_functions[endpoint] = cached_spec.response
+        cached_specs.append(cached_spec)
+    app.extensions['paket_openapi'] = cached_specs
+    return cached_specs
+
+
+def precompute(app):
+    """Render the cached specs of app now."""
+    with app.test_request_context():
+        for cached_spec in app.extensions.get('paket_openapi', []):
+            cached_spec.render()
+
+
+def dump(app, directory):
+    """Write the specs of app, with gzipped siblings, into a directory served by webserver.static."""
+    with app.test_request_context():
+        for cached_spec in app.extensions.get('paket_openapi', []):
+            path = os.path.join(directory, cached_spec.route.lstrip('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as spec_file:
+                spec_file.write(cached_spec.render())
+            with open(path + '.gz', 'wb') as spec_file:
+                spec_file.write(cached_spec.gzipped)
+            LOGGER.info("wrote %s", path)
@@ -0,0 +1,215 @@
+"""
+Pre-forking production server: the app is loaded once, then served by a number of forked worker processes.
+Signals to the master: SIGHUP replaces all workers gracefully, SIGTERM or SIGINT shut down.
+Since the app is loaded before forking, replaced workers run the same code - restart the master to deploy.
+"""
+import logging
+import os
+import random
+import signal
+import socket
+
+import werkzeug.serving
+
+import webserver
+import webserver.asgi
+import webserver.batch
+import webserver.logs
+import webserver.nonces
+import webserver.validation
+import webserver.verifiers
+
+LOGGER = logging.getLogger('pkt.web.prefork')
+# Worker processes, 0 to run the development server instead.
+WORKERS = int(os.environ.get('PAKET_WORKERS', 0))
+# Requests a worker serves before it is replaced, 0 to never replace workers.
+MAX_REQUESTS = int(os.environ.get('PAKET_MAX_REQUESTS', 0))
+# Have every worker bind its own SO_REUSEPORT socket, letting the kernel balance connections between them.
+# Connections still queued on the socket of an exiting worker are reset, so prefer a shared socket with MAX_REQUESTS.
+REUSE_PORT = bool(os.environ.get('PAKET_REUSE_PORT'))
+BACKLOG = 1024
+# Seconds a worker waits for connections before checking whether it should stop.
+POLL_INTERVAL = .5
+MASTER_SIGNALS = {signal.SIGCHLD, signal.SIGHUP, signal.SIGTERM, signal.SIGINT}
+
+
+def listen(host, port, reuse_port=False):
+    """A nonblocking listening socket, so workers sharing it can all wait on it without blocking in accept."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind((host, port))
+    listener.listen(BACKLOG)
+    listener.setblocking(False)
+    return listener
+
+
+def after_fork():
+    """
+    Replace what a forked worker inherits but can not share with its parent:
+    threads, which do not survive forking, and pools of connections or processes.
+    """
+    if webserver.STATIC_INDEX is not None:
+        webserver.STATIC_INDEX.start_refresh()
+    webserver.logs.after_fork()
+    webserver.validation.after_fork()
+    webserver.verifiers.after_fork()
+    webserver.asgi.after_fork()
+    webserver.batch.after_fork()
+
+
+def check_nonce_store(workers):
+    """
+    Raise ValueError if the nonce store can not be shared by workers processes:
+    each worker would have its own replay window, and accept a replay already seen by another.
+    """
+    store = webserver.validation.NONCE_STORE
+    if workers > 1 and (isinstance(store, webserver.nonces.ReplayWindowNonceStore) or (
+            store is None and webserver.nonces.NONCE_STORE == 'window')):
+        raise ValueError(
+            "the window nonce store lives in a single process, use a shared nonce store with {} workers".format(
+                workers))
+
+
+class Worker:
+    """A worker process serving requests one at a time, until told to stop or done with its share."""
+
+    def __init__(self, app, listener, max_requests=MAX_REQUESTS):
+        self.app = app
+        self.listener = listener
+        self.max_requests = max_requests
+        self.handled = 0
+        self.stopping = False
+
+    def __call__(self, environ, start_response):
+        self.handled += 1
+        return self.app(environ, start_response)
+
+    def stop(self, *_):
+        """Finish the current request and exit."""
+        self.stopping = True
+
+    def run(self):
+        """Serve until stopped or done."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGHUP, self.stop)
+        # The master handles interrupts for the whole process group.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+        after_fork()
+        host, port = self.listener.getsockname()[:2]
+        server = werkzeug.serving.make_server(host, port, self, fd=self.listener.fileno())
+        server.timeout = POLL_INTERVAL
+        while not self.stopping and not (self.max_requests and self.handled >= self.max_requests):
+            server.handle_request()
+        server.server_close()
+
+
+class PreforkServer:
+    """The master process, keeping the configured number of workers running."""
+
+    def __init__(self, app, host, port, workers, max_requests=MAX_REQUESTS, reuse_port=REUSE_PORT):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers_count = workers
+        self.max_requests = max_requests
+        self.reuse_port = reuse_port
+        self.listener = None
+        self.workers = set()
+        self.retiring = set()
+
+    def listen(self):
+        """Bind the listening socket shared by the workers, if they share one, and return the bound port."""
+        if self.listener is None and not self.reuse_port:
+            self.listener = listen(self.host, self.port)
+            self.port = self.listener.getsockname()[1]
+        return self.port
+
+    def spawn(self):
+        """Fork a worker."""
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+        exit_code = 0
+        try:
+            listener = self.listener or listen(self.host, self.port, True)
+            # Spread the replacements of workers started together.
+            Worker(self.app, listener, self.max_requests + random.randint(0, self.max_requests // 10)).run()
+        except BaseException:  # pylint: disable=broad-except
+            LOGGER.exception("worker %s failed", os.getpid())
+            exit_code = 1
+        finally:
+            # Never return into the master's code.
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+    def reap(self):
+        """Forget exited workers."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.workers and status:
+                LOGGER.warning("worker %s exited with status %s", pid, status)
+            self.workers.discard(pid)
+            self.retiring.discard(pid)
+
+    def run(self):
+        """Serve until told to stop."""
+        check_nonce_store(self.workers_count)
+        self.listen()
+        # Signals are blocked and waited for, so the master reacts to them, and to exiting workers, at once.
+        signal.pthread_sigmask(signal.SIG_BLOCK, MASTER_SIGNALS)
+        LOGGER.info("serving on %s:%s with %s workers", self.host, self.port, self.workers_count)
+        while True:
+            self.reap()
+            while len(self.workers) < self.workers_count:
+                self.spawn()
+            received = signal.sigtimedwait(MASTER_SIGNALS, POLL_INTERVAL)
+            if received is None or received.si_signo == signal.SIGCHLD:
+                continue
+            if received.si_signo != signal.SIGHUP:
+                break
+            LOGGER.info("replacing workers")
+            self.retiring.update(self.workers)
+            self.workers = set()
+            self.signal_all(self.retiring, signal.SIGTERM)
+        LOGGER.info("shutting down")
+        self.signal_all(self.workers | self.retiring, signal.SIGTERM)
+        for pid in self.workers | self.retiring:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+
+    @staticmethod
+    def signal_all(pids, signal_number):
+        """Signal processes, ignoring those already gone."""
+        for pid in pids:
+            try:
+                os.kill(pid, signal_number)
+            except ProcessLookupError:
+                pass
+
+
+def run(app, host, port, workers=WORKERS, max_requests=MAX_REQUESTS, reuse_port=REUSE_PORT, debug=False):
+    """Serve app with workers processes, or with the development server if there are none."""
+    if workers:
+        PreforkServer(app, host, port, workers, max_requests, reuse_port).run()
+    else:
+        app.run(host, port, debug)
+
+
+def add_arguments(parser):
+    """Add the server options, defaulting to their environment variables, to an argparse parser."""
+    parser.add_argument('--workers', type=int, default=WORKERS, help='worker processes, 0 for the development server')
+    parser.add_argument('--max-requests', type=int, default=MAX_REQUESTS, help='requests before replacing a worker')
+    parser.add_argument('--reuse-port', action='store_true', default=REUSE_PORT,
+                        help='a SO_REUSEPORT socket per worker instead of a shared one')
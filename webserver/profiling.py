@@ -0,0 +1,155 @@
+"""On demand sampling profiler for requests."""
+import collections
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import flask
+
+import webserver.validation
+
+LOGGER = logging.getLogger('pkt.web.profiling')
+# Collapsed stacks of every profiled endpoint are written here, one <endpoint>.folded file each.
+PROFILE_DIR = os.environ.get('PAKET_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'paket-profiles'))
+# Fraction of requests to profile without being asked to.
+PROFILE_RATE = float(os.environ.get('PAKET_PROFILE_RATE', 0))
+# Seconds between stack samples.
+PROFILE_INTERVAL = float(os.environ.get('PAKET_PROFILE_INTERVAL', .005))
+# Operator key that signs profile requests. Unsigned profile requests are honoured only in debug mode.
+PROFILER_PUBKEY = os.environ.get('PAKET_PROFILER_PUBKEY')
+# Seconds a signed profile request stays valid. Its timestamp is also a nonce of the operator key,
+# so each signed profile request is honoured once.
+PROFILE_REQUEST_TTL = 60
+PROFILE_HEADER = 'Profile'
+PROFILE_SIGNATURE_HEADER = 'Profile-Signature'
+
+
+def collapse_stack(frame):
+    """A frame's stack in the collapsed format, outermost call first."""
+    names = []
+    while frame is not None:
+        names.append("{}:{}".format(frame.f_code.co_filename, frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def profile_request_data(path, timestamp):
+    """The data an operator signs to profile a request to path, with a timestamp in milliseconds."""
+    return "profile,{},{}".format(path, timestamp)
+
+
+class Sampler:
+    """Samples the stacks of registered threads, running only while there are any."""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.targets = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, thread_id):
+        """Start sampling a thread, returning the counter its stacks are collected into."""
+        stacks = collections.Counter()
+        with self.lock:
+            self.targets[thread_id] = stacks
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return stacks
+
+    def stop(self, thread_id):
+        """Stop sampling a thread, returning its stacks."""
+        with self.lock:
+            return self.targets.pop(thread_id, collections.Counter())
+
+    def run(self):
+        """Sample until there is nothing left to sample."""
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            with self.lock:
+                if not self.targets:
+                    self.thread = None
+                    return
+                for thread_id, stacks in self.targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+
+class Profiler:
+    """Profiles requests on demand, aggregating the stacks of each endpoint."""
+
+    def __init__(self, directory=PROFILE_DIR, rate=PROFILE_RATE, interval=PROFILE_INTERVAL, pubkey=PROFILER_PUBKEY):
+        self.directory = directory
+        self.rate = rate
+        self.pubkey = pubkey
+        self.sampler = Sampler(interval)
+        self.profiles = collections.defaultdict(collections.Counter)
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """Whether any request can be profiled."""
+        return bool(self.rate or self.pubkey or webserver.validation.DEBUG)
+
+    def wanted(self, request):
+        """Whether to profile request."""
+        if self.rate and random.random() < self.rate:
+            return True
+        timestamp = request.headers.get(PROFILE_HEADER)
+        if timestamp is None:
+            return False
+        signature = request.headers.get(PROFILE_SIGNATURE_HEADER)
+        if signature is None:
+            return webserver.validation.DEBUG
+        if not self.pubkey:
+            return False
+        try:
+            if abs(time.time() - int(timestamp) / 1000) > PROFILE_REQUEST_TTL:
+                raise webserver.validation.InvalidSignature("expired profile request")
+            webserver.validation.check_signature(
+                self.pubkey, profile_request_data(request.path, timestamp), signature)
+            webserver.validation.update_nonce(self.pubkey, timestamp)
+        except (ValueError, webserver.validation.InvalidSignature, webserver.validation.InvalidNonce) as exception:
+            LOGGER.warning("refusing to profile %s: %s", request.path, exception)
+            return False
+        return True
+
+    def before_request(self):
+        """Start sampling the current request if it should be profiled."""
+        if self.wanted(flask.request):
+            flask.g.paket_profile = self.sampler.start(threading.get_ident())
+
+    def teardown_request(self, _=None):
+        """Stop sampling the current request and save its endpoint's profile."""
+        if flask.g.pop('paket_profile', None) is None:
+            return
+        stacks = self.sampler.stop(threading.get_ident())
+        endpoint = flask.request.endpoint or 'unmatched'
+        with self.lock:
+            profile = self.profiles[endpoint]
+            profile.update(stacks)
+            try:
+                self.write(endpoint, profile)
+            except OSError:
+                LOGGER.exception("can not write profile of %s", endpoint)
+
+    def write(self, endpoint, profile):
+        """Replace the collapsed stacks file of an endpoint."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "{}.folded".format(endpoint))
+        with open(path + '.tmp', 'w') as profile_file:
+            for stack, count in sorted(profile.items()):
+                profile_file.write("{} {}\n".format(stack, count))
+        os.replace(path + '.tmp', path)
+
+    def install(self, app):
+        """Hook into app, unless no request can be profiled, which leaves requests untouched."""
+        if self.enabled:
+            app.before_request(self.before_request)
+            app.teardown_request(self.teardown_request)
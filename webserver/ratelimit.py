@@ -0,0 +1,226 @@
+"""Rate limit storage shared by the worker processes of a host."""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import limits
+import limits.storage
+
+# Key hash, window start, last access, window length, current window count, previous window count.
+SLOT = struct.Struct('<QddIII')
+SLOTS_PER_BUCKET = 8
+DEFAULT_BUCKETS = 16384
+THREAD_LOCK_STRIPES = 64
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "paket-ratelimit-{}".format(os.getuid()))
+# Budget of every authenticated pubkey, charged by the cost of the calls it makes, e.g. '600 per minute'.
+# Disabled unless set.
+PUBKEY_LIMIT = os.environ.get('PAKET_PUBKEY_LIMIT', '')
+PUBKEY_LIMITER_STORAGE = os.environ.get(
+    'PAKET_PUBKEY_LIMITER_STORAGE', os.environ.get('PAKET_LIMITER_STORAGE', 'memory://'))
+
+
+class BudgetExceeded(Exception):
+    """Pubkey spent its rate limit budget."""
+
+
+def key_hash(key):
+    """A nonzero 64 bit hash of a key, zero marks empty slots."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+
+class SharedMemoryStorage(limits.storage.Storage):
+    """
+    A fixed size hash table in a memory mapped file, shared by all processes mapping it.
+    Keys hash into buckets of a few slots, each bucket guarded by a byte range lock on the file,
+    and when a bucket is full its least recently used key is evicted.
+    Counters are sliding windows: the previous window's count, weighted by how much of it still overlaps,
+    plus the current window's count.
+    Use with the fixed window strategies: paketshm:///path/to/file?buckets=16384
+    """
+    STORAGE_SCHEME = 'paketshm'
+
+    def __init__(self, uri=None, **options):
+        super().__init__(uri, **options)
+        parsed_uri = urllib.parse.urlparse(uri or '')
+        query = urllib.parse.parse_qs(parsed_uri.query)
+        self.path = parsed_uri.path or DEFAULT_PATH
+        self.buckets = int(query.get('buckets', [DEFAULT_BUCKETS])[0])
+        self.bucket_size = SLOT.size * SLOTS_PER_BUCKET
+        size = self.buckets * self.bucket_size
+        self.file_descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.file_descriptor).st_size < size:
+            os.ftruncate(self.file_descriptor, size)
+        self.table = mmap.mmap(self.file_descriptor, size)
+        # Record locks belong to processes, so threads of one process also need their own locks.
+        self.thread_locks = [threading.Lock() for _ in range(THREAD_LOCK_STRIPES)]
+
+    def lock_bucket(self, bucket):
+        """Lock a bucket against other threads and other processes."""
+        self.thread_locks[bucket % THREAD_LOCK_STRIPES].acquire()
+        fcntl.lockf(self.file_descriptor, fcntl.LOCK_EX, 1, bucket)
+
+    def unlock_bucket(self, bucket):
+        """Release a bucket."""
+        fcntl.lockf(self.file_descriptor, fcntl.LOCK_UN, 1, bucket)
+        self.thread_locks[bucket % THREAD_LOCK_STRIPES].release()
+
+    def find_slot(self, hashed_key, bucket, now, create):
+        """
+        Find the offset of the key's slot in a locked bucket, and its content.
+        If create is set, a missing key takes an empty or expired slot, or evicts the least recently used key.
+        """
+        free_offset = lru_offset = lru_access = None
+        for offset in range(bucket * self.bucket_size, (bucket + 1) * self.bucket_size, SLOT.size):
+            slot = SLOT.unpack_from(self.table, offset)
+            if slot[0] == hashed_key:
+                return offset, slot
+            # A slot untouched for two windows counts nothing anymore.
+            if slot[0] == 0 or slot[2] + 2 * slot[3] < now:
+                if free_offset is None:
+                    free_offset = offset
+            elif lru_access is None or slot[2] < lru_access:
+                lru_offset, lru_access = offset, slot[2]
+        if not create:
+            return None, None
+        return (lru_offset if free_offset is None else free_offset), None
+
+    @staticmethod
+    def slide(slot, now):
+        """Move a slot's windows forward to now, returning window start, current count and previous count."""
+        _, window_start, _, window_length, current, previous = slot
+        elapsed_windows = int((now - window_start) // window_length)
+        if elapsed_windows == 1:
+            return window_start + window_length, 0, current
+        if elapsed_windows > 1:
+            return window_start + elapsed_windows * window_length, 0, 0
+        return window_start, current, previous
+
+    @staticmethod
+    def estimate(window_start, window_length, current, previous, now):
+        """The sliding window count."""
+        overlap = 1 - (now - window_start) / window_length
+        return int(math.ceil(current + previous * overlap))
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        """Add amount hits to key, which has a window of expiry seconds, and return its count."""
+        hashed_key = key_hash(key)
+        bucket = hashed_key % self.buckets
+        now = time.time()
+        self.lock_bucket(bucket)
+        try:
+            offset, slot = self.find_slot(hashed_key, bucket, now, True)
+            if slot is None:
+                window_start, current, previous = now, 0, 0
+            else:
+                window_start, current, previous = self.slide(slot, now)
+            current += amount
+            SLOT.pack_into(self.table, offset, hashed_key, window_start, now, expiry, current, previous)
+        finally:
+            self.unlock_bucket(bucket)
+        return self.estimate(window_start, expiry, current, previous, now)
+
+    def get(self, key):
+        """The current count of key."""
+        hashed_key = key_hash(key)
+        bucket = hashed_key % self.buckets
+        now = time.time()
+        self.lock_bucket(bucket)
+        try:
+            _, slot = self.find_slot(hashed_key, bucket, now, False)
+        finally:
+            self.unlock_bucket(bucket)
+        if slot is None:
+            return 0
+        window_start, current, previous = self.slide(slot, now)
+        return self.estimate(window_start, slot[3], current, previous, now)
+
+    def get_expiry(self, key):
+        """When the current window of key ends."""
+        hashed_key = key_hash(key)
+        bucket = hashed_key % self.buckets
+        now = time.time()
+        self.lock_bucket(bucket)
+        try:
+            _, slot = self.find_slot(hashed_key, bucket, now, False)
+        finally:
+            self.unlock_bucket(bucket)
+        if slot is None:
+            return now
+        return self.slide(slot, now)[0] + slot[3]
+
+    def clear(self, key):
+        """Forget key."""
+        hashed_key = key_hash(key)
+        bucket = hashed_key % self.buckets
+        self.lock_bucket(bucket)
+        try:
+            offset, _ = self.find_slot(hashed_key, bucket, time.time(), False)
+            if offset is not None:
+                SLOT.pack_into(self.table, offset, 0, 0, 0, 0, 0, 0)
+        finally:
+            self.unlock_bucket(bucket)
+
+    def check(self):
+        """The table is always there."""
+        return True
+
+    def reset(self):
+        """Forget all keys."""
+        empty_bucket = bytes(self.bucket_size)
+        for bucket in range(self.buckets):
+            self.lock_bucket(bucket)
+            try:
+                self.table[bucket * self.bucket_size:(bucket + 1) * self.bucket_size] = empty_bucket
+            finally:
+                self.unlock_bucket(bucket)
+
+
+class PubkeyBudget:
+    """A cost weighted rate limit per pubkey."""
+
+    def __init__(self, limit=PUBKEY_LIMIT, storage_uri=PUBKEY_LIMITER_STORAGE):
+        self.item = limits.parse(limit)
+        self.storage = limits.storage.storage_from_string(storage_uri)
+
+    def charge(self, pubkey, cost):
+        """Charge cost to the pubkey's budget, raising BudgetExceeded if it is spent."""
+        if not cost:
+            return
+        key = self.item.key_for('pubkey', pubkey)
+        if isinstance(self.storage, SharedMemoryStorage):
+            count = self.storage.incr(key, self.item.get_expiry(), amount=cost)
+        else:
+            # Other storages only count single hits.
+            for _ in range(cost):
+                count = self.storage.incr(key, self.item.get_expiry())
+        if count > self.item.amount:
+            raise BudgetExceeded("pubkey {} exceeded its budget of {}".format(pubkey, self.item))
+
+
+# Created on first use, see get_pubkey_budget.
+PUBKEY_BUDGET = None
+PUBKEY_BUDGET_LOCK = threading.Lock()
+
+
+def get_pubkey_budget():
+    """Get the pubkey budget, creating it on first use. None if disabled."""
+    global PUBKEY_BUDGET  # pylint: disable=global-statement
+    if PUBKEY_BUDGET is None and PUBKEY_LIMIT:
+        with PUBKEY_BUDGET_LOCK:
+            if PUBKEY_BUDGET is None:
+                PUBKEY_BUDGET = PubkeyBudget()
+    return PUBKEY_BUDGET
+
+
+def charge_pubkey(pubkey, cost):
+    """Charge cost to the pubkey's budget, if there is one."""
+    budget = get_pubkey_budget()
+    if budget is not None and cost:
+        budget.charge(pubkey, cost)
@@ -0,0 +1,115 @@
+"""JSON serialization of responses."""
+import datetime
+import json
+import logging
+import os
+import time
+
+import flask
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # pylint: disable=invalid-name
+
+LOGGER = logging.getLogger('pkt.web.serialization')
+# 'orjson', 'json', or unset for the fastest installed one.
+JSON_BACKEND = os.environ.get('PAKET_JSON_BACKEND') or ('orjson' if orjson else 'json')
+SORT_KEYS = True
+# Non ASCII characters are written as UTF-8, not escaped, unless asked to (Flask's JSON_AS_ASCII).
+ENSURE_ASCII = False
+BASE_ENCODER = flask.json.JSONEncoder()
+
+
+def encode_default(obj):
+    """Serialize time as seconds since the epoch, and everything else the way Flask does."""
+    if isinstance(obj, datetime.datetime):
+        return int(obj.timestamp())
+    return BASE_ENCODER.default(obj)
+
+
+def dumps_json(obj, pretty=False, sort_keys=SORT_KEYS, ensure_ascii=ENSURE_ASCII, encoder=None):
+    """Serialize with the standard library, with encoder (a JSONEncoder class) if given."""
+    options = {'sort_keys': sort_keys, 'ensure_ascii': ensure_ascii}
+    if encoder is None:
+        options['default'] = encode_default
+    else:
+        options['cls'] = encoder
+    if pretty:
+        options['indent'] = 2
+    else:
+        options['separators'] = (',', ':')
+    return json.dumps(obj, **options).encode()
+
+
+def dumps_orjson(obj, pretty=False, sort_keys=SORT_KEYS, ensure_ascii=ENSURE_ASCII, encoder=None):
+    """
+    Serialize with orjson, falling back to the standard library for what orjson refuses,
+    for custom encoders, and for non ASCII output that has to be escaped.
+    """
+    if encoder is not None:
+        return dumps_json(obj, pretty, sort_keys, ensure_ascii, encoder)
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        options |= orjson.OPT_SORT_KEYS
+    if pretty:
+        options |= orjson.OPT_INDENT_2
+    try:
+        output = orjson.dumps(obj, default=encode_default, option=options)
+    except orjson.JSONEncodeError:
+        # Integers over 64 bits, mostly.
+        return dumps_json(obj, pretty, sort_keys, ensure_ascii)
+    if ensure_ascii:
+        try:
+            output.decode('ascii')
+        except UnicodeDecodeError:
+            return dumps_json(obj, pretty, sort_keys, ensure_ascii)
+    return output
+
+
+BACKENDS = {'json': dumps_json}
+if orjson:
+    BACKENDS['orjson'] = dumps_orjson
+
+
+def dumps(obj, pretty=False, backend=None, sort_keys=SORT_KEYS, ensure_ascii=ENSURE_ASCII, encoder=None):
+    """
+    Serialize obj to JSON bytes, compact unless pretty is set.
+    Every backend gives the same bytes, encoder (a JSONEncoder class) replacing encode_default if given.
+    """
+    return BACKENDS[backend or JSON_BACKEND](obj, pretty, sort_keys, ensure_ascii, encoder)
+
+
+def response(obj, status=200):
+    """A JSON response, like flask.jsonify makes but faster, following the app's JSON configuration."""
+    app = flask.current_app
+    pretty = app.config['JSONIFY_PRETTYPRINT_REGULAR'] or app.debug
+    # Flask's own encoder is the default, which encode_default extends.
+    encoder = None if app.json_encoder is flask.json.JSONEncoder else app.json_encoder
+    return app.response_class(
+        dumps(obj, pretty, sort_keys=app.config['JSON_SORT_KEYS'], ensure_ascii=app.config['JSON_AS_ASCII'],
+              encoder=encoder),
+        status, mimetype=app.config['JSONIFY_MIMETYPE'])
+
+
+def benchmark(iterations=200):
+    """Measure serializations per second of a list-heavy payload with every backend."""
+    now = datetime.datetime.now()
+    payload = {'status': 200, 'packages': [{
+        'escrow_pubkey': 'GAM7BELNXMX5I3CQRGQAFAYF73FMT7CV2RJHUPEYAIINT5YJ726UY2GG',
+        'launcher_pubkey': 'GBAVMZAX35P2S7L3ZVLX35GPFRQ5JYJTW5UYCH4GBW2RPSRWGAAOOPST',
+        'payment': index * 10, 'collateral': index * 20, 'deadline': now, 'set_options_transaction': None,
+        'events': [{'event_type': 'launched', 'timestamp': now, 'location': '32.1,34.8'}] * 3,
+    } for index in range(500)]}
+    results = {}
+    for backend in BACKENDS:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            dumps(payload, backend=backend)
+        results[backend] = iterations / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == '__main__':
+    for backend_name, rate in sorted(benchmark().items(), key=lambda item: -item[1]):
+        print("{:<8}{:>10.0f} payloads per second".format(backend_name, rate))
@@ -0,0 +1,145 @@
+"""Indexed static file serving."""
+import logging
+import mimetypes
+import os
+import threading
+import time
+
+import flask
+import werkzeug.security
+
+import webserver.metrics
+
+LOGGER = logging.getLogger('pkt.web.static')
+# Files up to this size are kept in memory, as long as the total stays under STATIC_CACHE_SIZE.
+STATIC_CACHE_MAX_FILE_SIZE = int(os.environ.get('PAKET_STATIC_CACHE_MAX_FILE_SIZE', 256 * 1024))
+STATIC_CACHE_SIZE = int(os.environ.get('PAKET_STATIC_CACHE_SIZE', 64 * 1024 * 1024))
+# Seconds between rescans of the static directories, 0 to never rescan.
+STATIC_REFRESH_INTERVAL = float(os.environ.get('PAKET_STATIC_REFRESH_INTERVAL', 0))
+# Precompressed siblings, preferred in this order.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+class StaticFile:
+    """An indexed file."""
+
+    def __init__(self, full_path, stat):
+        self.full_path = full_path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = "{:x}-{:x}".format(stat.st_mtime_ns, stat.st_size)
+        self.content = None
+        self.variants = {}
+
+
+class StaticIndex:
+    """
+    An index of the files in a list of directories, earlier directories taking precedence.
+    Lookups of indexed files never touch the file system, and small files are served from memory.
+    Files added since the index was built are looked for on disk, and served from there until the next rebuild.
+    """
+
+    def __init__(self, directories, cache_max_file_size=STATIC_CACHE_MAX_FILE_SIZE, cache_size=STATIC_CACHE_SIZE):
+        self.directories = directories
+        self.cache_max_file_size = cache_max_file_size
+        self.cache_size = cache_size
+        self.files = {}
+        self.build()
+
+    def build(self):
+        """Scan the directories and replace the index."""
+        files = {}
+        for directory in self.directories:
+            directory = os.path.abspath(directory)
+            for root, _, file_names in os.walk(directory):
+                for file_name in file_names:
+                    full_path = os.path.join(root, file_name)
+                    path = os.path.relpath(full_path, directory).replace(os.sep, '/')
+                    if path not in files:
+                        try:
+                            files[path] = StaticFile(full_path, os.stat(full_path))
+                        except OSError:
+                            LOGGER.warning("can not index %s", full_path)
+        for path, static_file in files.items():
+            for encoding, suffix in ENCODINGS:
+                if path + suffix in files:
+                    static_file.variants[encoding] = files[path + suffix]
+        self.load_contents(files)
+        # Swapping the whole dict keeps lookups lock free.
+        self.files = files
+        LOGGER.debug("indexed %s static files", len(files))
+
+    def load_contents(self, files):
+        """Read small files into memory, reusing what the current index already read."""
+        previous_files = {static_file.full_path: static_file for static_file in self.files.values()}
+        cached_size = 0
+        for static_file in sorted(files.values(), key=lambda static_file: static_file.size):
+            if static_file.size > self.cache_max_file_size or cached_size + static_file.size > self.cache_size:
+                break
+            previous = previous_files.get(static_file.full_path)
+            if previous is not None and previous.etag == static_file.etag and previous.content is not None:
+                static_file.content = previous.content
+            else:
+                try:
+                    with open(static_file.full_path, 'rb') as content_file:
+                        static_file.content = content_file.read()
+                except OSError:
+                    continue
+            cached_size += static_file.size
+
+    def refresh_forever(self, interval):
+        """Rebuild the index every interval seconds."""
+        while True:
+            time.sleep(interval)
+            try:
+                self.build()
+            except OSError:
+                LOGGER.exception("static index refresh failed")
+
+    def start_refresh(self, interval=STATIC_REFRESH_INTERVAL):
+        """Rebuild the index periodically in a daemon thread, if interval is set."""
+        if interval:
+            threading.Thread(target=self.refresh_forever, args=(interval,), daemon=True).start()
+
+    def find(self, path):
+        """A StaticFile for path from the directories, unindexed, or None if there is no such file."""
+        for directory in self.directories:
+            full_path = werkzeug.security.safe_join(os.path.abspath(directory), path)
+            if full_path is not None and os.path.isfile(full_path):
+                try:
+                    return StaticFile(full_path, os.stat(full_path))
+                except OSError:
+                    return None
+        return None
+
+    def response(self, path):
+        """A response serving path to the current request, or None if there is no such file."""
+        static_file = self.files.get(path) or self.find(path)
+        if static_file is None:
+            webserver.metrics.STATIC_REQUESTS.inc('miss')
+            return None
+        served_file, served_encoding = static_file, None
+        for encoding, _ in ENCODINGS:
+            if encoding in static_file.variants and flask.request.accept_encodings[encoding]:
+                served_file, served_encoding = static_file.variants[encoding], encoding
+                break
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        # If-None-Match compares weakly, and compression weakens the ETag (see webserver.compression).
+        if flask.request.if_none_match.contains_weak(served_file.etag):
+            webserver.metrics.STATIC_REQUESTS.inc('not_modified')
+            response = flask.current_app.response_class(status=304)
+        elif served_file.content is not None:
+            webserver.metrics.STATIC_REQUESTS.inc('memory')
+            response = flask.current_app.response_class(served_file.content, mimetype=mimetype)
+        else:
+            webserver.metrics.STATIC_REQUESTS.inc('disk')
+            response = flask.send_file(served_file.full_path, mimetype=mimetype, add_etags=False)
+        response.set_etag(served_file.etag)
+        response.last_modified = served_file.mtime
+        response.cache_control.public = True
+        response.cache_control.max_age = flask.current_app.get_send_file_max_age(path)
+        if static_file.variants:
+            response.vary.add('Accept-Encoding')
+        if served_encoding:
+            response.headers['Content-Encoding'] = served_encoding
+        return response
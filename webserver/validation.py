@@ -1,8 +1,11 @@
 """Validations for API calls."""
 import base64
 import functools
+import inspect
 import logging
 import os
+import tempfile
+import threading
 import time
 
 import flask
@@ -11,16 +14,39 @@ import stellar_base.utils
 
 import util.db
 
+import webserver.cache
+import webserver.logs
+import webserver.metrics
+import webserver.nonces
+import webserver.ratelimit
+import webserver.serialization
+import webserver.verifiers
+
 LOGGER = logging.getLogger('pkt.api.validation')
 DEBUG = bool(os.environ.get('PAKET_DEBUG'))
 KWARGS_CHECKERS_AND_FIXERS = {}
 CUSTOM_EXCEPTION_STATUSES = {}
 INTERNAL_ERROR_CODES = {}
-DB_HOST = os.environ.get('PAKET_DB_HOST', '127.0.0.1')
-DB_PORT = int(os.environ.get('PAKET_DB_PORT', 3306))
-DB_USER = os.environ.get('PAKET_DB_USER', 'root')
-DB_PASSWORD = os.environ.get('PAKET_DB_PASSWORD')
-DB_NAME = os.environ.get('PAKET_DB_NAME', 'paket')
+# Created from configuration on first use, see get_nonce_store.
+NONCE_STORE = None
+NONCE_STORE_LOCK = threading.Lock()
+COMPACT_FINGERPRINT_PREFIX = '$1:'
+# Legacy fingerprints are taken literally, unless they start with this and are backslash escaped.
+ESCAPED_FINGERPRINT_PREFIX = '$e:'
+UPLOAD_MODES = ('bytes', 'stream', 'memoryview')
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Uploads kept as streams stay in memory up to this size, and are spooled to disk above it.
+UPLOAD_SPOOL_SIZE = int(os.environ.get('PAKET_UPLOAD_SPOOL_SIZE', 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.environ['PAKET_MAX_UPLOAD_SIZE']) if 'PAKET_MAX_UPLOAD_SIZE' in os.environ else None
+# WSGI environ key of the pubkey that signed the batch a sub-call is part of (see webserver.batch).
+AUTHENTICATED_PUBKEY = 'paket.authenticated_pubkey'
+# Deprecated, nonces are kept by the store in NONCE_STORE, configured in webserver.nonces.
+# Kept for code that imports the database configuration, or connects to it, from here.
+DB_HOST = webserver.nonces.DB_HOST
+DB_PORT = webserver.nonces.DB_PORT
+DB_USER = webserver.nonces.DB_USER
+DB_PASSWORD = webserver.nonces.DB_PASSWORD
+DB_NAME = webserver.nonces.DB_NAME
 SQL_CONNECTION = util.db.custom_sql_connection(DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME)
 
 
@@ -52,39 +78,36 @@ class ExtraField(Exception):
     """Unexpected fields in args"""
 
 
+def get_nonce_store():
+    """Get the configured nonce store, creating it on first use."""
+    global NONCE_STORE  # pylint: disable=global-statement
+    if NONCE_STORE is None:
+        with NONCE_STORE_LOCK:
+            if NONCE_STORE is None:
+                NONCE_STORE = webserver.nonces.from_config()
+    return NONCE_STORE
+
+
+def after_fork():
+    """Drop the nonce store inherited from the parent process, its connections and flush thread are not ours."""
+    global NONCE_STORE  # pylint: disable=global-statement
+    NONCE_STORE = None
+
+
 def init_nonce_db():
     """Initialize the nonces database."""
-    with SQL_CONNECTION() as sql:
-        # Not using IF EXISTS here in case we want different handling.
-        sql.execute("""
-            SELECT 1 FROM information_schema.tables
-            WHERE table_schema = %s
-            AND table_name = 'nonces'""", (DB_NAME,))
-        if len(sql.fetchall()) == 1:
-            LOGGER.debug('nonces table already exists')
-            return
-        sql.execute('''
-            CREATE TABLE nonces(
-                pubkey VARCHAR(56) PRIMARY KEY,
-                user_name VARCHAR(32) UNIQUE,
-                nonce BIGINT NOT NULL DEFAULT 0)''')
-        LOGGER.debug('nonces table created')
+    get_nonce_store().init_db()
 
 
 def update_nonce(pubkey, new_nonce, user_name=None):
     """Update a user's nonce (or create it)."""
-    with SQL_CONNECTION() as sql:
-        sql.execute("SELECT nonce FROM nonces WHERE pubkey = %s", (pubkey,))
-        try:
-            if int(new_nonce) <= sql.fetchone()['nonce']:
-                raise InvalidNonce("nonce {} is not bigger than current nonce".format(new_nonce))
-        except TypeError:
-            sql.execute("INSERT INTO nonces (pubkey) VALUES (%s)", (pubkey,))
-        except ValueError:
-            raise InvalidNonce("fingerprint does not end with an integer nonce ({})".format(new_nonce))
-        sql.execute("UPDATE nonces SET nonce = %s WHERE pubkey = %s", (new_nonce, pubkey))
-        if user_name:
-            sql.execute("UPDATE nonces SET user_name = %s WHERE pubkey = %s", (user_name, pubkey))
+    try:
+        new_nonce = int(new_nonce)
+    except ValueError:
+        raise InvalidNonce("fingerprint does not end with an integer nonce ({})".format(new_nonce))
+    # Every store accepts text pubkeys, as MySQL did bytes ones.
+    if not get_nonce_store().advance(webserver.nonces.pubkey_text(pubkey), new_nonce, user_name):
+        raise InvalidNonce("nonce {} is not bigger than current nonce".format(new_nonce))
 
 
 def check_missing_fields(fields, required_fields):
@@ -96,33 +119,125 @@ def check_missing_fields(fields, required_fields):
         raise MissingFields("Request does not contain field(s): {}".format(', '.join(missing_fields)))
 
 
-def generate_fingerprint(uri, kwargs=None):
-    """Helper function creating fingerprints for debug purposes."""
-    kwargstring = ','.join([''] + ["{}={}".format(key, val) for key, val in kwargs.items()]) if kwargs else ''
-    return "{}{},{}".format(uri, kwargstring, int(time.time() * 1000.0))
+def escape_fingerprint_value(value, delimiters=',='):
+    """Escape the characters that delimit legacy fingerprint fields."""
+    value = str(value)
+    if '\\' in value or any(delimiter in value for delimiter in delimiters):
+        value = value.replace('\\', '\\\\')
+        for delimiter in delimiters:
+            value = value.replace(delimiter, '\\' + delimiter)
+    return value
+
+
+def generate_fingerprint(uri, kwargs=None, compact=False, nonce=None):
+    """
+    Helper function creating fingerprints for debug purposes.
+    The legacy format is <uri>,[key=value,...]<nonce>, prefixed by ESCAPED_FINGERPRINT_PREFIX and backslash
+    escaped if anything in it needs escaping; the compact one is COMPACT_FINGERPRINT_PREFIX followed by
+    length prefixed fields, keys sorted.
+    """
+    if nonce is None:
+        nonce = int(time.time() * 1000.0)
+    kwargs = kwargs or {}
+    if compact:
+        fields = [uri]
+        for key in sorted(kwargs):
+            fields.extend((key, str(kwargs[key])))
+        fields.append(str(nonce))
+        return COMPACT_FINGERPRINT_PREFIX + ''.join("{}:{}".format(len(field), field) for field in fields)
+    # Only commas delimit the uri, and urls with query strings are full of equal signs.
+    fields = [escape_fingerprint_value(uri, ',')]
+    fields.extend(
+        "{}={}".format(escape_fingerprint_value(key), escape_fingerprint_value(val)) for key, val in kwargs.items())
+    plain_fields = [str(uri)] + ["{}={}".format(key, val) for key, val in kwargs.items()]
+    prefix = '' if fields == plain_fields else ESCAPED_FINGERPRINT_PREFIX
+    return prefix + ','.join(fields + [str(nonce)])
+
+
+def split_escaped(string, separator, maxsplit=-1, unescape=True):
+    """Split string on unescaped separators, optionally unescaping as we go."""
+    fields = []
+    field = []
+    escaped = False
+    for char in string:
+        if escaped:
+            field.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+            if not unescape:
+                field.append(char)
+        elif char == separator and maxsplit != len(fields):
+            fields.append(''.join(field))
+            field = []
+        else:
+            field.append(char)
+    fields.append(''.join(field))
+    return fields
+
+
+def parse_compact_fingerprint(fingerprint):
+    """Parse the length prefixed fields of a compact fingerprint."""
+    fields = []
+    position = len(COMPACT_FINGERPRINT_PREFIX)
+    try:
+        while position < len(fingerprint):
+            colon = fingerprint.index(':', position)
+            length = fingerprint[position:colon]
+            # Only plain decimal lengths, so a fingerprint has a single spelling and always moves forward.
+            if not length.isdigit() or str(int(length)) != length:
+                raise ValueError('bad field length')
+            end = colon + 1 + int(length)
+            if end <= position or end > len(fingerprint):
+                raise ValueError('field overflows fingerprint')
+            fields.append(fingerprint[colon + 1:end])
+            position = end
+    except ValueError:
+        raise FingerprintMismatch("malformed compact fingerprint {}".format(fingerprint))
+    if len(fields) < 2 or len(fields) % 2:
+        raise FingerprintMismatch("malformed compact fingerprint {}".format(fingerprint))
+    return fields[0], list(zip(fields[1:-1:2], fields[2:-1:2])), fields[-1]
+
+
+def parse_fingerprint(fingerprint):
+    """Parse a fingerprint of either format into its url, a list of (key, value) pairs and its nonce."""
+    if fingerprint.startswith(COMPACT_FINGERPRINT_PREFIX):
+        return parse_compact_fingerprint(fingerprint)
+    # Legacy fingerprints are split as they always were, backslashes in them included.
+    if fingerprint.startswith(ESCAPED_FINGERPRINT_PREFIX):
+        # Fields keep their escapes until they are split into keys and values.
+        fields = split_escaped(fingerprint[len(ESCAPED_FINGERPRINT_PREFIX):], ',', unescape=False)
+        pairs = [split_escaped(field, '=', 1) for field in fields[1:-1]]
+        fields[0] = split_escaped(fields[0], ',')[0]
+    else:
+        fields = fingerprint.split(',')
+        pairs = [field.split('=', 1) for field in fields[1:-1]]
+    if any(len(pair) != 2 for pair in pairs):
+        raise FingerprintMismatch("malformed fingerprint {}".format(fingerprint))
+    return fields[0], pairs, fields[-1]
 
 
 def check_fingerprint(user_pubkey, fingerprint, url, kwargs):
     """
     Raise exception on invalid fingerprint.
     """
-    # Copy kwargs before we destroy it.
-    kwargs = dict(kwargs)
-    fingerprint = fingerprint.split(',')
-    if url != fingerprint[0]:
-        raise FingerprintMismatch("fingerprint {} does not match call to {}".format(fingerprint[0], url))
-    for key, val in [keyval.split('=') for keyval in fingerprint[1:-1]]:
-        try:
-            call_val = str(kwargs.pop(key))
-        except KeyError:
+    fingerprint_url, pairs, nonce = parse_fingerprint(fingerprint)
+    if url != fingerprint_url:
+        raise FingerprintMismatch("fingerprint {} does not match call to {}".format(fingerprint_url, url))
+    matched_keys = set()
+    for key, val in pairs:
+        if key in matched_keys or key not in kwargs:
             raise FingerprintMismatch("fingerprint has extra value {} = {}".format(key, val))
+        matched_keys.add(key)
+        call_val = str(kwargs[key])
         if call_val != val:
             raise FingerprintMismatch("fingerprint {key} = {val} does not match call {key} = {call_val}".format(
                 key=key, val=val, call_val=call_val))
-    if kwargs:
-        raise FingerprintMismatch("fingerprint is missing a value for {}".format(', '.join((kwargs.keys()))))
+    if len(matched_keys) != len(kwargs):
+        raise FingerprintMismatch("fingerprint is missing a value for {}".format(
+            ', '.join(key for key in kwargs if key not in matched_keys)))
     try:
-        update_nonce(user_pubkey, fingerprint[-1])
+        update_nonce(user_pubkey, nonce)
     except InvalidNonce as exception:
         raise FingerprintMismatch(str(exception))
 
@@ -143,13 +258,10 @@ def check_signature(user_pubkey, fingerprint, signature):
     except base64.binascii.Error:
         raise InvalidSignature('Signature is not base64 encoded')
     fingerprint = bytes(fingerprint, 'utf-8')
-    # pylint: disable=broad-except
-    # If anything fails, we want to raise our own exception.
     try:
-        stellar_base.keypair.Keypair.from_address(user_pubkey).verify(fingerprint, signature)
-    except Exception:
+        webserver.verifiers.verify(user_pubkey, fingerprint, signature)
+    except webserver.verifiers.BadSignature:
         raise InvalidSignature("Signature does not match pubkey {} and data {}".format(user_pubkey, fingerprint))
-    # pylint: enable=broad-except
 
 
 def check_and_fix_natural(key, value):
@@ -169,9 +281,10 @@ KWARGS_CHECKERS_AND_FIXERS['_nat'] = check_and_fix_natural
 
 def check_pubkey(key, value):
     """Raise exception if value is not a valid pubkey."""
+    # Decoded by the verifiers cache, so a pubkey checked here is ready for its signature to be checked.
     try:
-        stellar_base.keypair.Keypair.from_address(value)
-    except (TypeError, stellar_base.utils.DecodeError):
+        webserver.verifiers.load_key(value)
+    except (TypeError, ValueError, stellar_base.utils.DecodeError):
         warning = "the value of {}({}) is not a valid public key".format(key, value)
         if DEBUG:
             LOGGER.warning(warning)
@@ -183,11 +296,47 @@ def check_pubkey(key, value):
 KWARGS_CHECKERS_AND_FIXERS['_pubkey'] = check_pubkey
 
 
-def check_and_extract_files(request):
+def read_upload(file, mode, max_size, size):
+    """
+    Read an uploaded file in chunks, into bytes, a memoryview, or a spooled stream (according to mode).
+    Raise util.db.DataTooBig as soon as the total size of uploads so far passes max_size.
+    Return the extracted file and the new total size.
+    """
+    buffer = tempfile.SpooledTemporaryFile(UPLOAD_SPOOL_SIZE) if mode == 'stream' else bytearray()
+    for chunk in iter(functools.partial(file.stream.read, UPLOAD_CHUNK_SIZE), b''):
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            if mode == 'stream':
+                buffer.close()
+            raise util.db.DataTooBig("uploaded files are bigger than {} bytes".format(max_size))
+        if mode == 'stream':
+            buffer.write(chunk)
+        else:
+            buffer.extend(chunk)
+    if mode == 'stream':
+        buffer.seek(0)
+        return buffer, size
+    if mode == 'memoryview':
+        return memoryview(buffer), size
+    return bytes(buffer), size
+
+
+def check_and_extract_files(request, mode='bytes', max_size=MAX_UPLOAD_SIZE):
     """
     Check if request contains files and extract them.
     """
-    return {arg_name: file.stream.read() for arg_name, file in request.files.items()}
+    files = {}
+    size = 0
+    for arg_name, file in request.files.items():
+        files[arg_name], size = read_upload(file, mode, max_size, size)
+    return files
+
+
+def close_uploads(kwargs):
+    """Close uploads that were extracted as streams."""
+    for value in kwargs.values():
+        if isinstance(value, tempfile.SpooledTemporaryFile):
+            value.close()
 
 
 def check_and_fix_values(kwargs):
@@ -201,21 +350,108 @@ def check_and_fix_values(kwargs):
     return kwargs
 
 
-def check_and_fix_call(request, required_fields, require_auth):
-    """Extract kwargs and validate call."""
+class CallPlan:
+    """
+    How to validate the arguments of a handler, worked out from its signature once, when it is decorated.
+    Per call work is then proportional to the number of arguments, not to the number of registered fixers.
+    """
+
+    def __init__(self, handler, required_fields=None, require_auth=False, upload_mode='bytes',
+                 max_upload_size=MAX_UPLOAD_SIZE, cost=1):
+        self.cost = cost
+        if upload_mode not in UPLOAD_MODES:
+            raise ValueError("unknown upload mode {}, choose one of: {}".format(upload_mode, ', '.join(UPLOAD_MODES)))
+        self.upload_mode = upload_mode
+        self.max_upload_size = max_upload_size
+        try:
+            parameters = inspect.signature(handler).parameters.values()
+        except (TypeError, ValueError):
+            # No signature to go by, accept anything like we used to.
+            parameters = [inspect.Parameter('kwargs', inspect.Parameter.VAR_KEYWORD)]
+        self.accepts_any = any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters)
+        keyword_parameters = [
+            parameter for parameter in parameters
+            if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)]
+        self.allowed_fields = {parameter.name for parameter in keyword_parameters}
+        self.required_fields = set(required_fields or ()).union(
+            parameter.name for parameter in keyword_parameters if parameter.default is parameter.empty)
+        if require_auth:
+            # Supplied by authentication, not by the caller.
+            self.required_fields.discard('user_pubkey')
+        self.bind_fixers()
+
+    def bind_fixers(self):
+        """Bind the registered checkers and fixers to the parameters they apply to."""
+        self.registered_fixers_count = len(KWARGS_CHECKERS_AND_FIXERS)
+        self.fixers = {
+            field: [fixer for suffix, fixer in KWARGS_CHECKERS_AND_FIXERS.items() if field.endswith(suffix)]
+            for field in self.allowed_fields}
+
+    def check_fields(self, fields):
+        """Raise exception on missing or unexpected fields."""
+        check_missing_fields(fields, self.required_fields)
+        if not self.accepts_any:
+            extra_fields = set(fields) - self.allowed_fields
+            if extra_fields:
+                raise ExtraField("extra argument(s): {}".format(', '.join(sorted(extra_fields))))
+
+    def fix_values(self, kwargs):
+        """Run kwargs through the checkers and fixers bound to them."""
+        # Checkers and fixers registered after decoration are picked up here.
+        if self.registered_fixers_count != len(KWARGS_CHECKERS_AND_FIXERS):
+            self.bind_fixers()
+        for key, value in kwargs.items():
+            try:
+                fixers = self.fixers[key]
+            except KeyError:
+                # Only handlers accepting **kwargs get here.
+                fixers = [fixer for suffix, fixer in KWARGS_CHECKERS_AND_FIXERS.items() if key.endswith(suffix)]
+            for fixer in fixers:
+                value = kwargs[key] = fixer(key, value)
+        return kwargs
+
+
+def check_and_fix_call(request, required_fields, require_auth, plan=None, stages=None):
+    """
+    Extract kwargs and validate call, all field checks done before any authentication.
+    If stages is given, the seconds spent verifying the signature and committing the nonce are recorded in it.
+    Sub-calls of a batch are authenticated by the batch, so they are only charged.
+    """
     if not DEBUG and '/debug/' in request.path:
         raise DebugOnly("{} only accesible in debug mode".format(request.path))
+    upload_mode, max_upload_size = ('bytes', MAX_UPLOAD_SIZE) if plan is None else (
+        plan.upload_mode, plan.max_upload_size)
+    # Refuse oversized bodies before the form, and the files in it, are parsed.
+    if max_upload_size is not None and (request.content_length or 0) > max_upload_size:
+        raise util.db.DataTooBig("request is bigger than {} bytes".format(max_upload_size))
     kwargs = request.values.to_dict()
-    check_missing_fields(kwargs.keys(), required_fields)
-    if require_auth:
+    if plan is None:
+        check_missing_fields(kwargs.keys(), required_fields)
+    else:
+        plan.check_fields(set(kwargs).union(request.files))
+    authenticated_pubkey = request.environ.get(AUTHENTICATED_PUBKEY)
+    if require_auth and authenticated_pubkey is not None:
+        if not DEBUG:
+            webserver.ratelimit.charge_pubkey(authenticated_pubkey, 1 if plan is None else plan.cost)
+        kwargs['user_pubkey'] = authenticated_pubkey
+    elif require_auth:
         check_missing_fields(request.headers.keys(), ['Pubkey'])
         if not DEBUG:
             check_missing_fields(request.headers.keys(), ['Fingerprint', 'Signature'])
+            start = time.perf_counter()
             check_signature(request.headers['pubkey'], request.headers['Fingerprint'], request.headers['Signature'])
+            verified = time.perf_counter()
             check_fingerprint(request.headers['pubkey'], request.headers['Fingerprint'], request.url, kwargs)
+            if stages is not None:
+                stages['verify'] = verified - start
+                stages['nonce'] = time.perf_counter() - verified
+            # Charged only once the nonce advanced, so replays of a captured call can not drain the budget.
+            webserver.ratelimit.charge_pubkey(request.headers['Pubkey'], 1 if plan is None else plan.cost)
         kwargs['user_pubkey'] = request.headers['Pubkey']
-    kwargs.update(check_and_extract_files(request))
-    return check_and_fix_values(kwargs)
+    kwargs.update(check_and_extract_files(request, upload_mode, max_upload_size))
+    if plan is None:
+        return check_and_fix_values(kwargs)
+    return plan.fix_values(kwargs)
 
 
 def optional_arg_decorator(decorator):
@@ -237,6 +473,8 @@ CUSTOM_EXCEPTION_STATUSES[AssertionError] = 400
 CUSTOM_EXCEPTION_STATUSES[FingerprintMismatch] = 403
 CUSTOM_EXCEPTION_STATUSES[InvalidSignature] = 403
 CUSTOM_EXCEPTION_STATUSES[NotImplementedError] = 501
+CUSTOM_EXCEPTION_STATUSES[webserver.ratelimit.BudgetExceeded] = 429
+CUSTOM_EXCEPTION_STATUSES[webserver.verifiers.VerifierBusy] = 503
 
 
 INTERNAL_ERROR_CODES[MissingFields] = 100
@@ -246,45 +484,95 @@ INTERNAL_ERROR_CODES[InvalidNonce] = 102
 INTERNAL_ERROR_CODES[InvalidSignature] = 103
 INTERNAL_ERROR_CODES[FingerprintMismatch] = 104
 INTERNAL_ERROR_CODES[util.db.DataTooBig] = 105
+INTERNAL_ERROR_CODES[webserver.verifiers.VerifierBusy] = 107
+INTERNAL_ERROR_CODES[webserver.ratelimit.BudgetExceeded] = 108
 INTERNAL_ERROR_CODES[DebugOnly] = 121
 
 
+def error_response(exception, request):
+    """Build the response for an exception raised while handling a call."""
+    response = {'status': CUSTOM_EXCEPTION_STATUSES.get(type(exception), 500)}
+    if response['status'] == 500:
+        LOGGER.error("%s", webserver.logs.KeyValues(
+            event='unknown_exception', method=request.method, path=request.path, remote=request.remote_addr,
+            user_agent=request.headers.get('User-Agent')), exc_info=exception)
+        response['error'] = {'message': 'internal server error', 'error_code': response['status']}
+        if DEBUG:
+            response['error']['debug'] = str(exception)
+    else:
+        response['error'] = {
+            'message': str(exception),
+            'error_code': response['status'],
+            'internal_error_code': INTERNAL_ERROR_CODES.get(type(exception), 0)}
+    return response
+
+
+def log_error(endpoint, response):
+    """Log an error response as key=value pairs, rendered off the request path (see webserver.logs)."""
+    error = response['error']
+    if not isinstance(error, dict):
+        error = {'message': error}
+    LOGGER.error("%s", webserver.logs.KeyValues(
+        event='call_error', endpoint=endpoint, status=response.get('status', 200),
+        internal_error_code=error.get('internal_error_code', 0), message=error.get('message')))
+
+
 # Since this is a decorator the handler argument will never be None, it is
 # defined as such only to comply with python's syntactic sugar.
 @optional_arg_decorator
-def call(handler=None, required_fields=None, require_auth=None):
+def call(handler=None, required_fields=None, require_auth=None,
+         upload_mode='bytes', max_upload_size=MAX_UPLOAD_SIZE, cost=1, cache=None):
     """
     A decorator to handle all API calls: extracts arguments, validates them,
     fixes them, handles authentication, and then passes them to the handler,
     dealing with exceptions and returning a valid response.
+    Uploaded files are passed as bytes, as memoryviews or as spooled streams, according to upload_mode,
+    and requests bigger than max_upload_size bytes are refused.
+    Authenticated calls charge cost to the caller's pubkey budget.
+    The time spent in each stage of the call is recorded in webserver.metrics.
+    If cache is set, successful responses to GET and HEAD requests are reused for cache seconds by calls
+    with the same arguments (see webserver.cache), so only use it for handlers without side effects.
+    The cache is then the cache attribute of the returned view, for invalidation.
     """
+    plan = CallPlan(handler, required_fields, require_auth or False, upload_mode, max_upload_size, cost)
+    response_cache = webserver.cache.ResponseCache(
+        webserver.cache.cache_name(handler), cache) if cache else None
+
     @functools.wraps(handler)
     def _call(*_, **__):
+        kwargs = {}
+        stages = {}
+        start = time.perf_counter()
         # pylint: disable=broad-except
         # If anything fails, we want to catch it here.
         try:
-            kwargs = check_and_fix_call(flask.request, required_fields, require_auth or False)
             try:
+                kwargs = check_and_fix_call(flask.request, required_fields, require_auth or False, plan, stages)
+            finally:
+                extracted = time.perf_counter()
+                stages['extract'] = extracted - start - stages.get('verify', 0) - stages.get('nonce', 0)
+            cacheable = response_cache is not None and flask.request.method in webserver.cache.CACHED_METHODS \
+                and not flask.request.files
+            response = response_cache.get(kwargs) if cacheable else None
+            if response is None:
                 response = handler(**kwargs)
-            except TypeError as exception:
-                extra_arg_name_position = str(exception).find('unexpected keyword argument ')
-                if extra_arg_name_position > -1:
-                    raise ExtraField("extra argument {}".format(str(exception)[extra_arg_name_position:]))
-                raise
+                if cacheable:
+                    response_cache.put(kwargs, response)
+            stages['handler'] = time.perf_counter() - extracted
         except Exception as exception:
-            response = {'status': CUSTOM_EXCEPTION_STATUSES.get(type(exception), 500)}
-            if response['status'] == 500:
-                LOGGER.exception("Unknown validation exception. Headers: %s", flask.request.headers)
-                response['error'] = {'message': 'internal server error', 'error_code': response['status']}
-                if DEBUG:
-                    response['error']['debug'] = str(exception)
-            else:
-                response['error'] = {
-                    'message': str(exception),
-                    'error_code': response['status'],
-                    'internal_error_code': INTERNAL_ERROR_CODES.get(type(exception), 0)}
+            response = error_response(exception, flask.request)
+            cacheable = False
         # pylint: enable=broad-except
+        close_uploads(kwargs)
         if 'error' in response:
-            LOGGER.error(response['error'])
-        return flask.make_response(flask.jsonify(response), response.get('status', 200))
+            log_error(handler.__name__, response)
+        serialize_start = time.perf_counter()
+        flask_response = webserver.serialization.response(response, response.get('status', 200))
+        if cacheable and flask_response.status_code == 200:
+            flask_response = webserver.cache.add_headers(
+                flask_response, response_cache, 'user_pubkey' in kwargs, flask.request)
+        stages['serialize'] = time.perf_counter() - serialize_start
+        webserver.metrics.observe_call(handler.__name__, stages, response)
+        return flask_response
+    _call.cache = response_cache
     return _call
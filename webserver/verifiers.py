@@ -0,0 +1,243 @@
+"""Ed25519 signature verification backends."""
+import concurrent.futures
+import functools
+import logging
+import os
+import threading
+import time
+
+import stellar_base.keypair
+import stellar_base.utils
+
+LOGGER = logging.getLogger('pkt.api.verifiers')
+BACKEND_NAME = os.environ.get('PAKET_ED25519_BACKEND')
+KEY_CACHE_SIZE = int(os.environ.get('PAKET_PUBKEY_CACHE_SIZE', 4096))
+SIGNATURE_LENGTH = 64
+# Order of the Ed25519 base point, the S half of a canonical signature is smaller.
+GROUP_ORDER = 2 ** 252 + 27742317777372353535851937790883648493
+# Offloading verification to a pool is off unless PAKET_VERIFY_WORKERS is set.
+OFFLOAD_WORKERS = int(os.environ.get('PAKET_VERIFY_WORKERS', 0))
+OFFLOAD_MODE = os.environ.get('PAKET_VERIFY_MODE', 'auto')
+OFFLOAD_QUEUE_SIZE = int(os.environ.get('PAKET_VERIFY_QUEUE_SIZE', 64))
+OFFLOAD_QUEUE_TIMEOUT = float(os.environ.get('PAKET_VERIFY_QUEUE_TIMEOUT', 1))
+
+
+class BadSignature(Exception):
+    """Signature verification failed."""
+
+
+class VerifierBusy(Exception):
+    """Verification queue is full."""
+
+
+class Backend:
+    """
+    An Ed25519 implementation.
+    load turns a Stellar address into a key object, verify raises BadSignature on any failure.
+    """
+    name = None
+    # Whether verification runs without holding the GIL, so threads can verify in parallel.
+    releases_gil = False
+
+    def load(self, address):
+        """Load a verifying key from a Stellar address."""
+        raise NotImplementedError
+
+    def verify(self, key, data, signature):
+        """Verify signature on data with key."""
+        raise NotImplementedError
+
+
+class NaClBackend(Backend):
+    """libsodium through PyNaCl."""
+    name = 'nacl'
+    releases_gil = True
+
+    def __init__(self):
+        # pylint: disable=import-error
+        import nacl.exceptions
+        import nacl.signing
+        # pylint: enable=import-error
+        self.verify_key = nacl.signing.VerifyKey
+        self.errors = (nacl.exceptions.BadSignatureError, nacl.exceptions.ValueError)
+
+    def load(self, address):
+        return self.verify_key(stellar_base.utils.decode_check('account', address))
+
+    def verify(self, key, data, signature):
+        try:
+            key.verify(data, signature)
+        except self.errors:
+            raise BadSignature()
+
+
+class CryptographyBackend(Backend):
+    """OpenSSL through cryptography."""
+    name = 'cryptography'
+
+    def __init__(self):
+        # pylint: disable=import-error
+        import cryptography.exceptions
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+        # pylint: enable=import-error
+        self.public_key = ed25519.Ed25519PublicKey
+        self.errors = (cryptography.exceptions.InvalidSignature, ValueError)
+
+    def load(self, address):
+        return self.public_key.from_public_bytes(stellar_base.utils.decode_check('account', address))
+
+    def verify(self, key, data, signature):
+        try:
+            key.verify(signature, data)
+        except self.errors:
+            raise BadSignature()
+
+
+class StellarBackend(Backend):
+    """Whatever stellar_base uses, always available."""
+    name = 'stellar'
+
+    def load(self, address):
+        return stellar_base.keypair.Keypair.from_address(address)
+
+    def verify(self, key, data, signature):
+        # pylint: disable=broad-except
+        # Implementations raise different exceptions, we want our own.
+        try:
+            key.verify(data, signature)
+        except Exception:
+            raise BadSignature()
+        # pylint: enable=broad-except
+
+
+# Fastest first.
+BACKENDS = [NaClBackend, CryptographyBackend, StellarBackend]
+
+
+def available_backends():
+    """Instantiate all installed backends, fastest first."""
+    backends = []
+    for backend_class in BACKENDS:
+        try:
+            backends.append(backend_class())
+        except ImportError:
+            LOGGER.debug('%s ed25519 backend not installed', backend_class.name)
+    return backends
+
+
+def get_backend(name=None):
+    """Get the backend named by name or PAKET_ED25519_BACKEND, or the fastest installed one."""
+    name = name or BACKEND_NAME
+    backends = available_backends()
+    if name is None:
+        return backends[0]
+    for backend in backends:
+        if backend.name == name:
+            return backend
+    raise ValueError("ed25519 backend {} is not available, choose one of: {}".format(
+        name, ', '.join(backend.name for backend in backends)))
+
+
+BACKEND = get_backend()
+LOGGER.debug('using %s ed25519 backend', BACKEND.name)
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def load_key(address):
+    """
+    Load a verifying key with the selected backend, keeping recently used ones.
+    This is the only pubkey cache, hit and miss counters are available from load_key.cache_info().
+    """
+    return BACKEND.load(address)
+
+
+def verify_inline(address, data, signature):
+    """Verify in the calling thread, raising BadSignature on failure."""
+    # Checked here so that all backends agree on malformed and malleated signatures.
+    if len(signature) != SIGNATURE_LENGTH or int.from_bytes(signature[32:], 'little') >= GROUP_ORDER:
+        raise BadSignature()
+    try:
+        key = load_key(address)
+    except (TypeError, ValueError, stellar_base.utils.DecodeError):
+        raise BadSignature()
+    BACKEND.verify(key, data, signature)
+
+
+class OffloadPool:
+    """
+    Run verifications on a pool with a bounded queue.
+    Threads are used if the backend releases the GIL, processes otherwise.
+    """
+
+    def __init__(self, workers, mode, queue_size, queue_timeout):
+        if mode == 'auto':
+            mode = 'thread' if BACKEND.releases_gil else 'process'
+        if mode == 'thread':
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        elif mode == 'process':
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            raise ValueError("unknown verification offload mode {}".format(mode))
+        self.mode = mode
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.queue_timeout = queue_timeout
+        LOGGER.debug('offloading verification to %s %s workers', workers, mode)
+
+    def verify(self, address, data, signature):
+        """Verify on the pool, raising VerifierBusy if the queue stays full."""
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise VerifierBusy("signature verification queue is full")
+        try:
+            self.executor.submit(verify_inline, address, data, signature).result()
+        finally:
+            self.slots.release()
+
+
+# Created on first use, so forked workers do not share a pool.
+OFFLOAD_POOL = None
+OFFLOAD_POOL_LOCK = threading.Lock()
+
+
+def get_offload_pool():
+    """Get the offload pool, creating it on first use."""
+    global OFFLOAD_POOL  # pylint: disable=global-statement
+    if OFFLOAD_POOL is None:
+        with OFFLOAD_POOL_LOCK:
+            if OFFLOAD_POOL is None:
+                OFFLOAD_POOL = OffloadPool(OFFLOAD_WORKERS, OFFLOAD_MODE, OFFLOAD_QUEUE_SIZE, OFFLOAD_QUEUE_TIMEOUT)
+    return OFFLOAD_POOL
+
+
+def after_fork():
+    """Drop the offload pool inherited from the parent process, its workers are not ours."""
+    global OFFLOAD_POOL  # pylint: disable=global-statement
+    OFFLOAD_POOL = None
+
+
+def verify(address, data, signature):
+    """Raise BadSignature unless signature is a valid signature of data by address."""
+    if OFFLOAD_WORKERS:
+        get_offload_pool().verify(address, data, signature)
+    else:
+        verify_inline(address, data, signature)
+
+
+def benchmark(iterations=1000):
+    """Measure verifications per second of every installed backend."""
+    keypair = stellar_base.keypair.Keypair.random()
+    address = keypair.address().decode()
+    data = b'/v1/benchmark,arg=value,1528265594985'
+    signature = keypair.sign(data)
+    results = {}
+    for backend in available_backends():
+        key = backend.load(address)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            backend.verify(key, data, signature)
+        results[backend.name] = iterations / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == '__main__':
+    for backend_name, rate in sorted(benchmark().items(), key=lambda item: -item[1]):
+        print("{:<14}{:>12.0f} verifications per second".format(backend_name, rate))